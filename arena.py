@@ -0,0 +1,243 @@
+import os
+import json
+import random
+import struct
+import numpy as np
+from multiprocessing import shared_memory
+
+# File layout (as `fpindex`): magic | version (uint32) | header length (uint32) | JSON header | padding | offsets | data.
+MAGIC = b'NUTARENA'
+VERSION = 1
+ALIGNMENT = 64
+
+# Block layout: number of strings (int64) | offsets (int64, one more than strings) | UTF-8 data.
+HEADER_SIZE = 8
+
+def _narrow_offsets(offsets):
+  # int32 offsets, unless the data needs more.
+  offsets = np.asarray(offsets, dtype=np.int64)
+  if len(offsets) and offsets[-1] < 2**31:
+    return offsets.astype(np.int32)
+  return offsets
+
+class StringArena:
+# Strings as one UTF-8 buffer plus offsets: string `idx` is `data[offsets[idx]:offsets[idx + 1]]`.
+  def __init__(self, offsets, data):
+    self.offsets = offsets
+    self.data = data
+
+  @classmethod
+  def from_strings(cls, strings):
+  # Packs `strings` (a list, an Arrow string column or another arena).
+    import nutella
+    offsets, data = nutella.column_buffers(strings)
+
+    # Only keep the bytes covered.
+    data = np.ascontiguousarray(data[offsets[0]:offsets[-1]])
+    return cls(_narrow_offsets(offsets - offsets[0]), data)
+
+  @classmethod
+  def from_file(cls, path, strip_spaces=False):
+  # Reads the lines of `path` (as `utils.read_words`) without creating a string per line.
+    assert os.path.isfile(path), f'File {path} does not exist!'
+    raw = np.fromfile(path, dtype=np.uint8)
+
+    # Whitespace stripping and universal newlines need the per-line path.
+    if strip_spaces or (raw == ord('\r')).any():
+      with open(path) as f:
+        return cls.from_strings([line.strip() if strip_spaces else line.strip('\n') for line in f])
+
+    # The last line need not end with a newline.
+    newlines = np.flatnonzero(raw == ord('\n'))
+    ends = newlines if not len(raw) or raw[-1] == ord('\n') else np.append(newlines, len(raw))
+    lengths = ends - np.concatenate([[0], newlines + 1])[:len(ends)]
+
+    offsets = np.zeros(len(ends) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return cls(_narrow_offsets(offsets), raw[raw != ord('\n')])
+
+  def save(self, path):
+    offsets = np.ascontiguousarray(self.offsets - self.offsets[0])
+    data = np.ascontiguousarray(self.data[self.offsets[0]:self.offsets[-1]])
+
+    # The header.
+    header = {
+      'num_strings' : len(self),
+      'offsets_dtype' : offsets.dtype.newbyteorder('<').str,
+      'num_bytes' : len(data)
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = MAGIC + struct.pack('<II', VERSION, len(header_bytes)) + header_bytes
+    padding = b'\0' * (-len(prefix) % ALIGNMENT)
+
+    # Write to a temporary file first, so readers never see a partial arena.
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      f.write(prefix + padding)
+      f.write(offsets.astype(header['offsets_dtype']).tobytes())
+      f.write(data.tobytes())
+    os.replace(tmp_path, path)
+
+  @classmethod
+  def load(cls, path, mmap=True):
+  # Reads an arena written by `save`; memory-mapped, only the pages touched are read.
+    with open(path, 'rb') as f:
+      magic = f.read(len(MAGIC))
+      assert magic == MAGIC, f'{path} is not a string arena!'
+      version, header_length = struct.unpack('<II', f.read(8))
+      assert version == VERSION, f'Unsupported arena version: {version}'
+      header = json.loads(f.read(header_length).decode('utf-8'))
+    offsets_offset = len(MAGIC) + 8 + header_length
+    offsets_offset += -offsets_offset % ALIGNMENT
+
+    offsets_dtype = np.dtype(header['offsets_dtype'])
+    data_offset = offsets_offset + offsets_dtype.itemsize * (header['num_strings'] + 1)
+    if not mmap or not header['num_bytes']:
+      raw = np.fromfile(path, dtype=np.uint8)
+      return cls(raw[offsets_offset:data_offset].view(offsets_dtype), raw[data_offset:data_offset + header['num_bytes']])
+    offsets = np.memmap(path, dtype=offsets_dtype, mode='r', offset=offsets_offset, shape=(header['num_strings'] + 1,))
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=data_offset, shape=(header['num_bytes'],))
+    return cls(offsets, data)
+
+  @property
+  def nbytes(self):
+    return self.offsets.nbytes + self.data.nbytes
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, idx):
+    # Slices are views on the same buffers.
+    if isinstance(idx, slice):
+      start, stop, step = idx.indices(len(self))
+      if step != 1:
+        return self.take(range(start, stop, step))
+      return StringArena(self.offsets[start:max(start, stop) + 1], self.data)
+
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError('StringArena index out of range')
+    return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+  def iter_bytes(self):
+  # Yields the (UTF-8) bytes of the strings, without decoding them.
+    data, offsets = self.data, self.offsets.tolist()
+    for idx in range(len(self)):
+      yield data[offsets[idx]:offsets[idx + 1]].tobytes()
+
+  def __iter__(self):
+    for value in self.iter_bytes():
+      yield value.decode('utf-8')
+
+  def to_list(self):
+    return list(self)
+
+  def take(self, indices):
+  # Returns a (compact) arena of the strings at `indices`.
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    starts = self.offsets[indices].astype(np.int64)
+    lengths = self.offsets[indices + 1].astype(np.int64) - starts
+
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # Gather the bytes of all strings at once.
+    positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return StringArena(_narrow_offsets(offsets), self.data[positions])
+
+  def shuffled_block(self, seed, block_size, nr_block):
+  # Block `nr_block` of the strings shuffled with `random.Random(seed)` (as the optimizer's `subset_words_shuffled_block`).
+    if block_size >= len(self):
+      return self
+
+    start = nr_block * block_size
+    if start >= len(self):
+      raise IndexError(f'Block start index {start} is out of bounds for {len(self)} strings.')
+
+    # Shuffling the positions permutes exactly as shuffling the strings themselves.
+    order = list(range(len(self)))
+    random.Random(seed).shuffle(order)
+    return self.take(order[start:start + block_size])
+
+  def string_buffers(self):
+  # The `(offsets, data)` buffers, as taken by the fingerprint kernels (see `nutella.column_buffers`).
+    return self.offsets, self.data
+
+  def to_arrow(self):
+  # A (zero-copy) Arrow view of the strings.
+    import pyarrow as pa
+    array_type = pa.LargeStringArray if self.offsets.dtype == np.int64 else pa.StringArray
+    offsets = np.ascontiguousarray(self.offsets)
+    return array_type.from_buffers(len(self), pa.py_buffer(offsets), pa.py_buffer(self.data))
+
+class SharedStringArena(StringArena):
+# A string arena in a named shared memory block; other processes attach by name.
+  def __init__(self, shm, owner=False):
+    self.shm = shm
+    self.owner = owner
+    num_strings = int(np.ndarray(1, dtype=np.int64, buffer=shm.buf)[0])
+    offsets = np.ndarray(num_strings + 1, dtype=np.int64, buffer=shm.buf, offset=HEADER_SIZE)
+    data_offset = HEADER_SIZE + offsets.nbytes
+    super().__init__(offsets, np.ndarray(int(offsets[-1]), dtype=np.uint8, buffer=shm.buf, offset=data_offset))
+
+  @classmethod
+  def create(cls, strings):
+  # Stages `strings` (a list, an Arrow string column or an arena) into a new block.
+    packed = StringArena.from_strings(strings)
+    offsets, data = packed.offsets.astype(np.int64), packed.data
+
+    shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + offsets.nbytes + data.nbytes)
+    np.ndarray(1, dtype=np.int64, buffer=shm.buf)[0] = len(offsets) - 1
+    np.ndarray(len(offsets), dtype=np.int64, buffer=shm.buf, offset=HEADER_SIZE)[:] = offsets
+    np.ndarray(len(data), dtype=np.uint8, buffer=shm.buf, offset=HEADER_SIZE + offsets.nbytes)[:] = data
+    return cls(shm, owner=True)
+
+  @classmethod
+  def attach(cls, name):
+    return cls(shared_memory.SharedMemory(name=name))
+
+  @property
+  def name(self):
+    return self.shm.name
+
+  def close(self):
+    # Drop the views first: the block cannot be closed while they are exported.
+    self.offsets, self.data = None, None
+    try:
+      self.shm.close()
+    except BufferError:
+      # Still viewed (e.g., by Arrow arrays); the mapping goes away with them.
+      pass
+    if self.owner:
+      self.shm.unlink()
+
+class SharedDataset:
+# Named string arenas that are staged once and shared by all worker processes.
+  def __init__(self, arenas):
+    self.arenas = arenas
+
+  @classmethod
+  def create(cls, columns):
+  # Stages the `{name : strings}` columns.
+    return cls({name : SharedStringArena.create(strings) for name, strings in columns.items()})
+
+  @classmethod
+  def attach(cls, handles):
+    return cls({name : SharedStringArena.attach(block_name) for name, block_name in handles.items()})
+
+  @property
+  def handles(self):
+  # What the workers need to attach: the block names.
+    return {name : arena.name for name, arena in self.arenas.items()}
+
+  def __getitem__(self, name):
+    return self.arenas[name]
+
+  def __contains__(self, name):
+    return name in self.arenas
+
+  def close(self):
+    for arena in self.arenas.values():
+      arena.close()
@@ -0,0 +1,131 @@
+import numpy as np
+import nutella
+
+# Roaring-style containers: the rows are split into chunks of 2^16; a chunk holding
+# at most `ARRAY_LIMIT` rows of a bin is a sorted `uint16` array, otherwise a 2^16-bit bitmap.
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+ARRAY_LIMIT = 4096
+
+def _is_array(container):
+  return container.dtype == np.uint16
+
+def _container_cardinality(container):
+  if _is_array(container):
+    return len(container)
+  return int(nutella.compute_fingerprint_densities(container).sum())
+
+def _container_rows(container):
+  # The (chunk-local) rows of a container.
+  if _is_array(container):
+    return container.astype(np.int64)
+  return np.flatnonzero(np.unpackbits(container.view(np.uint8), bitorder='little'))
+
+def _build_container(rows):
+  # `rows` are the sorted, chunk-local rows of a bin.
+  if len(rows) <= ARRAY_LIMIT:
+    return rows.astype(np.uint16)
+  is_set = np.zeros(CHUNK_SIZE, dtype=bool)
+  is_set[rows] = True
+  return np.packbits(is_set, bitorder='little').view('<u8')
+
+def _intersect_containers(containers):
+  # Start from the smallest array (if any): it bounds the result.
+  arrays = sorted((container for container in containers if _is_array(container)), key=len)
+  bitmaps = [container for container in containers if not _is_array(container)]
+  if not arrays:
+    return np.bitwise_and.reduce(bitmaps)
+
+  ret = arrays[0]
+  for other in arrays[1:]:
+    ret = ret[np.isin(ret, other, assume_unique=True)]
+  for other in bitmaps:
+    ret = ret[((other[ret >> 6] >> (ret & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)]
+  return ret
+
+class BitmapIndex:
+# One compressed bitmap per bin; the candidates of a mask are the AND of the bitmaps of its bins.
+  def __init__(self, fingerprints, num_bins):
+    fingerprints = np.asarray(fingerprints)
+    self.num_bins = num_bins
+    self.num_rows = len(fingerprints)
+
+    # `bitmaps[bin_idx]` maps a chunk to its container; chunks without rows are not stored.
+    self.bitmaps = []
+    for bin_idx in range(num_bins):
+      words = fingerprints if fingerprints.ndim == 1 else fingerprints[:, bin_idx // 64]
+      rows = np.flatnonzero((words >> words.dtype.type(bin_idx % 64)) & words.dtype.type(1))
+      chunks = rows >> CHUNK_BITS
+      bounds = np.flatnonzero(np.diff(chunks)) + 1
+      self.bitmaps.append({
+        int(chunk_rows[0] >> CHUNK_BITS) : _build_container(chunk_rows & (CHUNK_SIZE - 1))
+        for chunk_rows in np.split(rows, bounds) if len(chunk_rows)
+      })
+
+  @classmethod
+  def build(cls, column, partition=None, num_bins=None):
+    # Fingerprint the column first.
+    fingerprinter = nutella.fetch_fingerprinter(partition, num_bins=num_bins)
+    return cls(fingerprinter.build_batch(column), fingerprinter.num_bins)
+
+  @property
+  def nbytes(self):
+    return sum(container.nbytes for bitmap in self.bitmaps for container in bitmap.values())
+
+  def _mask_bins(self, mask):
+    mask = int(mask)
+    return [bin_idx for bin_idx in range(self.num_bins) if (mask >> bin_idx) & 1]
+
+  def _candidate_containers(self, mask):
+    # Yields the chunks (and their containers) of the rows covering `mask`.
+    bitmaps = sorted((self.bitmaps[bin_idx] for bin_idx in self._mask_bins(mask)), key=len)
+    for chunk in sorted(bitmaps[0].keys()):
+      containers = [bitmap.get(chunk) for bitmap in bitmaps]
+      if all(container is not None for container in containers):
+        yield chunk, _intersect_containers(containers)
+
+  def count(self, mask):
+  # Counts the rows whose fingerprint covers `mask`.
+    if not self._mask_bins(mask):
+      return self.num_rows
+    return sum(_container_cardinality(container) for _, container in self._candidate_containers(mask))
+
+  def row_ids(self, mask):
+  # Returns the (sorted) rows whose fingerprint covers `mask`.
+    if not self._mask_bins(mask):
+      return np.arange(self.num_rows)
+    rows = [_container_rows(container) + (chunk << CHUNK_BITS) for chunk, container in self._candidate_containers(mask)]
+    return np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+def run_workload(words, workload, partition=None, num_bins=None, index=None):
+# Same as `nutella.run_workload`, but only checks the candidates of the bitmap index.
+  # Fetch the fingerprinter.
+  fingerprinter = nutella.fetch_fingerprinter(partition, num_bins=num_bins)
+
+  # Build the index, unless given.
+  if index is None:
+    index = BitmapIndex.build(words, fingerprinter)
+  assert index.num_rows == len(words)
+
+  info = []
+  for pattern, mask in zip(workload, nutella.fingerprints_to_ints(fingerprinter.build_mask_batch(workload))):
+    # No false negatives: all matches are among the candidates.
+    candidates = index.row_ids(mask)
+    num_matches = sum(nutella.matches_like_pattern(pattern, words[row]) for row in candidates.tolist())
+    info.append({
+      '#FPs' : len(candidates) - num_matches,
+      '#Ns' : len(words) - num_matches
+    })
+  return info
+
+def run_mechanism(words, workload, partition, index=None, verbose=False):
+  # Run all patterns at once.
+  info = run_workload(words, workload, partition=partition, index=index)
+
+  # Aggregate.
+  num_fps, num_negs, fpr = nutella.agg_info(info)
+
+  if verbose:
+    print(f'# [|words|={len(words)} |workload|={len(workload)}] => #TNS={num_negs - num_fps}, #FPs={num_fps}, #Ns={num_negs}, FPR={fpr}')
+
+  return fpr
@@ -1,14 +1,26 @@
 import duckdb
 import pandas as pd
 import nutella
+import layout
+import zonemap
+import fpindex
+import fprcache
+import arena
+import bitmap_index
 import utils
 import os
+import re
+import numpy as np
+from collections import OrderedDict
 from typing import List
 
 NUM_THREADS = 1
 OUTPUT_DIR = 'query-log'
 QUERY_DIR = 'prepared-queries'
 
+# The number of values held at once by the streaming evaluator.
+STREAM_BATCH_SIZE = 2**16
+
 INIT_DUCKDB_SQL = f'''
   DROP TABLE IF EXISTS tab;
   CREATE TABLE tab (
@@ -16,22 +28,57 @@ INIT_DUCKDB_SQL = f'''
   );
 '''
 
-INIT_NUTELLA_SQL = f'''
-  DROP TABLE IF EXISTS tab;
-  CREATE TABLE tab (
-    raw TEXT,
-    nutella INTEGER,
-    helper BOOLEAN
-  );
-'''
+def init_nutella_sql(num_bins, packed=False):
+  return f'''
+    DROP TABLE IF EXISTS tab;
+    CREATE TABLE tab (
+      raw TEXT,
+      nutella {nutella.fingerprint_sql_type(num_bins, packed=packed)},
+      helper BOOLEAN
+    );
+  '''
+
+# The Arrow types of the vectorized UDF.
+ARROW_UDF_DTYPES = {
+  'UTINYINT' : 'uint8',
+  'USMALLINT' : 'uint16',
+  'UINTEGER' : 'uint32',
+  'UBIGINT' : 'uint64'
+}
 
 class NutellaFingerprint:
-  def __init__(self, partition):
-    # Fetch the byte mapping.
-    self.byte_mapping = nutella.fetch_byte_mapping(None, partition)
-
-  def __call__(self, value: str) -> int:
-    return nutella.build_fingerprint(value, self.byte_mapping)
+  def __init__(self, partition, packed=False, udf_type='arrow'):
+    # Fetch the fingerprinter.
+    self.fingerprinter = nutella.fetch_fingerprinter(partition)
+    self.num_bins = self.fingerprinter.num_bins
+    self.return_type = nutella.fingerprint_sql_type(self.num_bins, packed=packed)
+
+    # NOTE: Arrow has neither 128-bit unsigned integers nor bitstrings, so wider fingerprints stay scalar.
+    self.udf_type = udf_type
+    if udf_type == 'arrow' and self.return_type not in ARROW_UDF_DTYPES:
+      self.udf_type = 'native'
+
+    # The SQL macros only cover byte partitions up to `UHUGEINT`.
+    if udf_type == 'macro' and (not isinstance(self.fingerprinter, nutella.ByteFingerprinter) or self.num_bins > 128):
+      self.udf_type = 'native'
+
+  def __call__(self, value: str):
+    return nutella.fingerprint_sql_value(self.fingerprinter.build(value), self.num_bins)
+
+  def build_arrow(self, values):
+  # Fingerprints a whole Arrow vector at once.
+    import pyarrow as pa
+    fingerprints = self.fingerprinter.build_batch(values)
+    return pa.array(fingerprints.astype(ARROW_UDF_DTYPES[self.return_type]), mask=values.is_null().to_numpy(zero_copy_only=False))
+
+  def register(self, con, name='nutella_fp'):
+    if self.udf_type == 'macro':
+      # Pure SQL: DuckDB builds the fingerprints on all its threads.
+      con.execute(nutella.fingerprint_macros_sql(self.fingerprinter, name=name, sql_type=self.return_type))
+    elif self.udf_type == 'arrow':
+      con.create_function(name, self.build_arrow, ['VARCHAR'], self.return_type, type='arrow')
+    else:
+      con.create_function(name, self, ['VARCHAR'], self.return_type)
 
 class QueryWrapper:
   def __init__(self, competitor, tn, cn, config_name, workload_type, time_limit=None):
@@ -126,7 +173,7 @@ class QueryWrapper:
       {query}
     """
 
-def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn: str, cn: str, workload_type: str, time_limit: float, queries: List[str], partition: dict):
+def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn: str, cn: str, workload_type: str, time_limit: float, queries: List[str], partition: dict, layout_method: str = None, index_dir: str = None, packed: bool = False, udf_type: str = 'arrow'):
   print('Initializing DuckDB database..')
 
   # The config name.
@@ -149,26 +196,46 @@ def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn:
   import shutil
   shutil.copyfile(common_db_path, db_path)
 
-  byte_mapping = None
+  fingerprinter = None
   if competitor in ['naive', 'optimized']:
     # Open the connection to build nutella.
     con = utils.open_duckdb(db_path, read_only=False, num_threads=1)
 
     # Register the UDF.
-    fingerprint_builder = NutellaFingerprint(partition)
-    con.create_function('nutella_fp', fingerprint_builder, return_type='INT32')
+    fingerprint_builder = NutellaFingerprint(partition, packed=packed, udf_type=udf_type)
+    fingerprint_builder.register(con)
 
-    # Update the nutella column.
-    con.execute('''
-      UPDATE tab
-      SET nutella = nutella_fp(raw);
-    ''')
+    # Packed storage: the column must be as narrow as the fingerprints.
+    if packed:
+      con.execute(f'ALTER TABLE tab ALTER nutella SET DATA TYPE {fingerprint_builder.return_type};')
+
+    if index_dir is None:
+      # Update the nutella column.
+      con.execute('''
+        UPDATE tab
+        SET nutella = nutella_fp(raw);
+      ''')
+    else:
+      # Take the fingerprints of `tn.cn` from the index (`tab` holds its ASCII values).
+      fingerprints, num_bins = fetch_fingerprints(con, tn, cn, partition, index_dir=index_dir, source_sql='SELECT raw FROM tab;')
+      fp_expr = fpindex.register_index(con, 'fp_index', fingerprints, num_bins, fp_name='fp')
+      assert con.execute('SELECT COUNT(*) FROM tab;').fetchone()[0] == len(fingerprints)
+      con.execute(f'''
+        CREATE OR REPLACE TABLE tab AS
+        SELECT raw, CAST({fp_expr} AS {fingerprint_builder.return_type}) AS nutella, helper
+        FROM tab POSITIONAL JOIN fp_index;
+      ''')
+      con.unregister('fp_index')
+
+    # Cluster the rows by their fingerprints, if requested.
+    if layout_method is not None:
+      reorder_table(con, fingerprint_builder.fingerprinter, layout_method)
 
     # Close the connection.
     con.close()
 
-    # Take the byte mapping.
-    byte_mapping = nutella.fetch_byte_mapping(None, partition)
+    # Take the fingerprinter.
+    fingerprinter = fingerprint_builder.fingerprinter
 
   # Specify the wrapper.
   wrapper = QueryWrapper(competitor, tn, cn, config_name, workload_type, time_limit)
@@ -180,13 +247,13 @@ def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn:
       duckdb_query = f'''
         SELECT COUNT(*) AS match_count
         FROM tab
-        WHERE raw LIKE '%' || '{utils.sql_escape(pattern)}' || '%';
+        WHERE raw LIKE '{utils.sql_escape(nutella.like_expression(pattern))}';
       '''
       wrapped_query = wrapper.wrap_duckdb(idx, duckdb_query)
     else:
       # Build the nutella mask.
-      assert byte_mapping is not None
-      nutella_mask = nutella.build_fingerprint(pattern, byte_mapping)
+      assert fingerprinter is not None
+      nutella_mask = nutella.fingerprint_sql_literal(fingerprinter.build_mask(pattern), fingerprinter.num_bins)
 
       # Define the nutella helper.
       nutella_helper_query = f'''
@@ -205,7 +272,7 @@ def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn:
       nutella_query = f'''
         SELECT COUNT(*) AS match_count
         FROM tab
-        WHERE helper = TRUE AND raw LIKE '%' || '{utils.sql_escape(pattern)}' || '%';
+        WHERE helper = TRUE AND raw LIKE '{utils.sql_escape(nutella.like_expression(pattern))}';
       '''
 
       # The wrapper query.
@@ -216,17 +283,40 @@ def prepare_workload(competitor: str, config_file: str, common_db_path: str, tn:
 
   print('Preparation complete: database and SQL files ready.')
 
+def reorder_table(con, fingerprinter, method, block_size=zonemap.DEFAULT_BLOCK_SIZE):
+# Rewrites `tab` in the row order of the layout `method`.
+  # Fetch the rows.
+  rows = con.execute('SELECT rowid AS row_id, raw FROM tab;').fetch_arrow_table()
+
+  # Compute the layout.
+  permutation = layout.reorder(fingerprinter.build_batch(rows['raw']), method=method, block_size=block_size)
+  order_df = pd.DataFrame({
+    'row_id' : rows['row_id'].to_numpy()[permutation],
+    'position' : range(len(permutation))
+  })
+
+  # And rewrite the table.
+  con.register('order_df', order_df)
+  con.execute('''
+    CREATE OR REPLACE TABLE tab AS
+    SELECT tab.*
+    FROM tab JOIN order_df ON tab.rowid = order_df.row_id
+    ORDER BY order_df.position;
+  ''')
+  con.unregister('order_df')
+  return con
+
 def load_words(con, words, partition):  
-  # Create DataFrame for words
-  df = pd.DataFrame({ 'word' : words })
-  
   # Build fingerprints for words if not precomputed
-  byte_mapping = nutella.fetch_byte_mapping(None, partition)
-  df['word_fp'] = df['word'].apply(lambda w: nutella.build_fingerprint(w, byte_mapping))
+  fingerprinter = nutella.fetch_fingerprinter(partition)
+  fp_columns, fp_expr = nutella.fingerprint_columns(fingerprinter.build_batch(words), fingerprinter.num_bins, 'word_fp')
+
+  # Create DataFrame for words
+  df = pd.DataFrame({ 'word' : words.to_list() if isinstance(words, arena.StringArena) else words, **fp_columns })
 
   # Register table
   con.register('words_df', df)
-  con.execute('CREATE TABLE words AS SELECT * FROM words_df;')
+  con.execute(f'CREATE TABLE words AS SELECT word, {fp_expr} AS word_fp FROM words_df;')
   return con
 
 def fetch_imdb_column_data(tn, cn):
@@ -240,11 +330,140 @@ def fetch_imdb_column_data(tn, cn):
     WHERE {cn} ~ '^[\\x00-\\x7F]*$';
   ''').fetchdf()[cn]
 
-def load_table(con, tn, cn, partition):
+def fetch_imdb_column_arrow(tn, cn, db_path='./dbs/imdb.duckdb'):
+# Fetch the ASCII values of the column `cn` of table `tn` as an Arrow array.
+  con = utils.open_duckdb(db_path, read_only=True, num_threads=1)
+  column = con.execute(f'''
+    SELECT {cn}
+    FROM {tn}
+    WHERE {cn} ~ '^[\\x00-\\x7F]*$';
+  ''').fetch_arrow_table().column(0).combine_chunks()
+  con.close()
+  return column
+
+def count_imdb_column(tn, cn, db_path='./dbs/imdb.duckdb'):
+# The number of (non-null) values of the column `cn` of table `tn`; an upper bound of its ASCII values.
+  con = utils.open_duckdb(db_path, read_only=True, num_threads=1)
+  num_rows = con.execute(f'SELECT COUNT({cn}) FROM {tn};').fetchone()[0]
+  con.close()
+  return num_rows
+
+def iter_imdb_column_batches(tn, cn, batch_size=STREAM_BATCH_SIZE, db_path='./dbs/imdb.duckdb'):
+# Yields the ASCII values of the column `cn` of table `tn` as Arrow arrays of at most `batch_size` values.
+  con = utils.open_duckdb(db_path, read_only=True, num_threads=1)
+  try:
+    reader = con.execute(f'''
+      SELECT {cn}
+      FROM {tn}
+      WHERE {cn} ~ '^[\\x00-\\x7F]*$';
+    ''').fetch_record_batch(batch_size)
+    for batch in reader:
+      yield batch.column(0)
+  finally:
+    con.close()
+
+def like_regex(pattern):
+# The regex of the DuckDB predicate `value LIKE nutella.like_expression(pattern)` (`%`: any string, `_`: any character).
+  return '(?s)^' + ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in nutella.like_expression(pattern)) + '$'
+
+def batch_containment(column, queries):
+# Whether each value of the Arrow `column` contains each query (as `EvaluationSession._containment`).
+  import pyarrow.compute as pc
+  is_match = np.zeros((len(queries), len(column)), dtype=bool)
+  for idx, pattern in enumerate(queries):
+    # NOTE: Patterns without LIKE-wildcards can use the (much cheaper) substring search.
+    if ('%' not in pattern) and ('_' not in pattern):
+      matches = pc.match_substring(column, pattern)
+    else:
+      matches = pc.match_substring_regex(column, like_regex(pattern))
+    is_match[idx] = matches.to_numpy(zero_copy_only=False)
+  return is_match
+
+def stream_workload(batches, queries, partitions):
+# Accumulates the |partitions| x |queries| #FPs and #Ns over a stream of Arrow batches, holding a single batch at a time.
+  fingerprinters = [nutella.fetch_fingerprinter(partition) for partition in partitions]
+  stacked = all(isinstance(fingerprinter, nutella.ByteFingerprinter) for fingerprinter in fingerprinters)
+  masks = [fingerprinter.build_mask_batch(queries) for fingerprinter in fingerprinters]
+
+  num_fps = np.zeros((len(partitions), len(queries)), dtype=np.int64)
+  num_negs = np.zeros((len(partitions), len(queries)), dtype=np.int64)
+  for column in batches:
+    is_match = batch_containment(column, queries)
+
+    # Byte partitions are evaluated together (see `nutella.run_workload_multi`).
+    if stacked:
+      batch_fps, batch_negs = nutella.run_workload_multi(column, queries, fingerprinters, is_match=is_match)
+      num_fps += batch_fps
+      num_negs += batch_negs
+      continue
+
+    for idx, fingerprinter in enumerate(fingerprinters):
+      nutella_match = nutella.match_fingerprints(fingerprinter.build_batch(column), masks[idx])
+      num_fps[idx] += np.count_nonzero(nutella_match & ~is_match, axis=1)
+      num_negs[idx] += np.count_nonzero(~is_match, axis=1)
+  return num_fps, num_negs
+
+def agg_stream_fprs(num_fps, num_negs, label, verbose=False):
+# The FPR of each partition from the |partitions| x |queries| #FPs and #Ns of `stream_workload`.
+  ret = []
+  for idx in range(len(num_fps)):
+    fpr = num_fps[idx].sum() / num_negs[idx].sum() if num_negs[idx].sum() > 0 else np.inf
+    if verbose:
+      print(f'# [{label} |workload|={num_fps.shape[1]} partition={idx}] => #TNS={num_negs[idx].sum() - num_fps[idx].sum()}, #FPs={num_fps[idx].sum()}, #Ns={num_negs[idx].sum()}, FPR={fpr}')
+    ret.append(float(fpr))
+  return ret
+
+def stream_table_fprs(tn, cn, queries, partitions, batch_size=STREAM_BATCH_SIZE, db_path='./dbs/imdb.duckdb', verbose=False):
+# The FPRs of the `partitions` over the whole column, in one streaming pass with bounded memory.
+  num_fps, num_negs = stream_workload(iter_imdb_column_batches(tn, cn, batch_size=batch_size, db_path=db_path), queries, partitions)
+  return agg_stream_fprs(num_fps, num_negs, f'tn={tn} cn={cn}', verbose=verbose)
+
+def fetch_fingerprints(con, tn, cn, partition, index_dir=fpindex.INDEX_DIR, source_sql=None, db_path='./dbs/imdb.duckdb'):
+# Returns the fingerprints of the ASCII values of `cn` (and their number of bins), from the index if it is up to date.
+# NOTE: `source_sql` may read a copy of the column; the index is still keyed by `tn.cn` of `db_path`.
+  path = fpindex.index_path(index_dir, tn, cn, partition)
+  if source_sql is None:
+    source_sql = f'''
+      SELECT {cn}
+      FROM {tn}
+      WHERE {cn} ~ '^[\\x00-\\x7F]*$'
+    '''
+  source_sql = source_sql.strip().rstrip(';')
+
+  # (Re)build the index if there is none, or if it was built from other data (e.g., before the database was rebuilt).
+  source = fprcache.table_digest(db_path, tn, cn)
+  num_rows = con.execute(f'SELECT COUNT(*) FROM ({source_sql});').fetchone()[0]
+  if not os.path.exists(path) or not fpindex.is_current(fpindex.read_header(path)[0], source, num_rows):
+    column = con.execute(f'{source_sql};').fetch_arrow_table().column(0)
+    fpindex.build_index(path, column, partition, tn=tn, cn=cn, source=source)
+
+  # And map it.
+  header, fingerprints = fpindex.read_index(path, partition, source=source, num_rows=num_rows)
+  return fingerprints, header['num_bins']
+
+def load_table(con, tn, cn, partition, index_dir=None, udf_type='arrow'):
 # Loads the ASCII values of `cn` into a temporary table of `tn`.
+  if index_dir is not None:
+    # Take the fingerprints from the index.
+    fingerprints, num_bins = fetch_fingerprints(con, tn, cn, partition, index_dir=index_dir)
+    fp_expr = fpindex.register_index(con, 'fp_index', fingerprints, num_bins)
+
+    # Create the `words` table.
+    con.execute(f'''
+      CREATE TEMPORARY TABLE words AS
+      SELECT w.word, {fp_expr} AS word_fp
+      FROM (
+        SELECT {cn} as word
+        FROM {tn}
+        WHERE {cn} ~ '^[\\x00-\\x7F]*$'
+      ) w POSITIONAL JOIN fp_index;
+    ''')
+    con.unregister('fp_index')
+    return con
+
   # Register the UDF.
-  fingerprint_builder = NutellaFingerprint(partition)
-  con.create_function('nutella_fp', fingerprint_builder, return_type='INT32')
+  fingerprint_builder = NutellaFingerprint(partition, udf_type=udf_type)
+  fingerprint_builder.register(con)
 
   # Create the `words` table.
   con.execute(f'''
@@ -257,9 +476,14 @@ def load_table(con, tn, cn, partition):
   # And return.
   return con
 
-def compute_fpr(words, queries, partition, verbose=False):
+def compute_fpr(words, queries, partition, verbose=False, backend='duckdb'):
   print(f'len(words)={len(words)}, len(patterns)={len(queries)}')
 
+  # The bitmap index only checks the candidates of each pattern.
+  if backend == 'bitmap':
+    return bitmap_index.run_mechanism(words, queries, partition, verbose=verbose)
+  assert backend == 'duckdb', f'Unknown backend: {backend}'
+
   # Prepare an in-memory DuckDB connection.
   con = duckdb.connect(database=':memory:')
 
@@ -274,14 +498,32 @@ def compute_fpr(words, queries, partition, verbose=False):
     verbose=verbose
   )
 
-def compute_table_fpr(tn, cn, queries, partition, verbose=False):
+def compute_table_fpr(tn, cn, queries, partition, verbose=False, index_dir=None, backend='duckdb'):
   print(f'tn={tn}, cn={cn} len(patterns)={len(queries)}')
 
+  # Stream the column instead of loading it.
+  if backend == 'stream':
+    return stream_table_fprs(tn, cn, queries, [partition], verbose=verbose)[0]
+
   # Load the IMDb database.
   con = utils.open_duckdb('./dbs/imdb.duckdb', read_only=True, num_threads=1)
 
+  if backend == 'bitmap':
+    # Fetch the column and index it (from the fingerprint index, if any).
+    words = [word for (word,) in con.execute(f'''
+      SELECT {cn}
+      FROM {tn}
+      WHERE {cn} ~ '^[\\x00-\\x7F]*$';
+    ''').fetchall()]
+    index = None
+    if index_dir is not None:
+      fingerprints, num_bins = fetch_fingerprints(con, tn, cn, partition, index_dir=index_dir)
+      index = bitmap_index.BitmapIndex(fingerprints, num_bins)
+    return bitmap_index.run_mechanism(words, queries, partition, index=index, verbose=verbose)
+  assert backend == 'duckdb', f'Unknown backend: {backend}'
+
   # Load the table.
-  load_table(con, tn, cn, partition)
+  load_table(con, tn, cn, partition, index_dir=index_dir)
 
   # And compute the FPR.
   return nutella.run_mechanism_wrapper_with_duckdb(
@@ -291,21 +533,268 @@ def compute_table_fpr(tn, cn, queries, partition, verbose=False):
     verbose=verbose
   )
 
-def compute_fpr_for_entry(index, num_partitions, tn, cn, timestamp, partition, solution_value, train_words, train_queries, all_words, test_queries, generalization=False, table_generalization=False, verbose=False):
+class EvaluationSession:
+# Loads the word sets (and table columns) once and caches their containment and fingerprints across FPR runs.
+  def __init__(self, max_cached_fingerprints=8, chunk_size=2**14, cache=None, max_containment_bytes=2**28):
+    self.con = duckdb.connect(database=':memory:')
+    self.word_sets = {}
+    self.word_keys = {}
+    self.index_sources = {}
+    self.stream_sources = {}
+    self.containment = OrderedDict()
+    self.containment_bytes = 0
+    self.max_containment_bytes = max_containment_bytes
+    self.fingerprints = OrderedDict()
+    self.max_cached_fingerprints = max_cached_fingerprints
+    self.chunk_size = chunk_size
+
+    # The (optional) persistent cache of the FPRs.
+    self.cache = cache
+
+  def add_words(self, name, words):
+    import pyarrow as pa
+    if isinstance(words, arena.StringArena):
+      self._add(name, words.to_arrow())
+    else:
+      words = list(words)
+      self._add(name, pa.array(words, type=pa.string()))
+    self.word_keys[name] = fprcache.words_digest(words)
+
+  def add_table(self, name, tn, cn, index_dir=None, db_path='./dbs/imdb.duckdb', stream=False, batch_size=STREAM_BATCH_SIZE):
+    self.word_keys[name] = fprcache.table_digest(db_path, tn, cn)
+
+    # Streamed columns are never loaded; each evaluation reads them batch by batch.
+    if stream:
+      self.stream_sources[name] = (tn, cn, db_path, batch_size)
+      return
+
+    # Fetch the ASCII values of the column (as `load_table`).
+    self._add(name, fetch_imdb_column_arrow(tn, cn, db_path=db_path))
+
+    # The fingerprints of the column can come from its index.
+    if index_dir is not None:
+      self.index_sources[name] = (db_path, tn, cn, index_dir)
+
+  def add_arena(self, name, arena, key, index_source=None):
+  # Adds a word set staged in a (shared) arena, without copying it; `key` identifies its content (see `fprcache`).
+    self._add(name, arena.to_arrow())
+    self.word_keys[name] = key
+    if index_source is not None:
+      self.index_sources[name] = index_source
+
+  def _num_words(self, name):
+    return len(self.word_sets[name]) if name in self.word_sets else 'stream'
+
+  def _stream_fprs(self, name, queries, partitions, verbose=False):
+    tn, cn, db_path, batch_size = self.stream_sources[name]
+    return stream_table_fprs(tn, cn, queries, partitions, batch_size=batch_size, db_path=db_path, verbose=verbose)
+
+  def _add(self, name, column):
+    import pyarrow as pa
+    self.word_sets[name] = column
+
+    # NOTE: A view on the Arrow column, not a copy; the scans keep the insertion order.
+    self.con.register(name, pa.table({ 'word' : column }))
+
+  def _containment(self, name, queries):
+    # Whether each word contains each query (independent of the partition, so cached).
+    # NOTE: `None` if the matrix exceeds `max_containment_bytes` (e.g., whole table columns); the callers then count chunk by chunk.
+    key = (name, tuple(queries))
+    if key in self.containment:
+      self.containment.move_to_end(key)
+      return self.containment[key]
+    if len(queries) * len(self.word_sets[name]) > self.max_containment_bytes:
+      return None
+
+    is_match = np.zeros((len(queries), len(self.word_sets[name])), dtype=bool)
+    for idx, pattern in enumerate(queries):
+      # NOTE: Patterns without LIKE-wildcards can use the (much cheaper) `contains`.
+      is_literal = ('%' not in pattern) and ('_' not in pattern)
+      predicate = 'contains(word, ?)' if is_literal else 'word LIKE ?'
+      is_match[idx] = self.con.execute(f'SELECT {predicate} AS is_match FROM "{name}";', [pattern if is_literal else nutella.like_expression(pattern)]).fetchnumpy()['is_match']
+
+    # Least recently used matrices are evicted first.
+    self.containment[key] = is_match
+    self.containment_bytes += is_match.nbytes
+    while self.containment_bytes > self.max_containment_bytes:
+      _, evicted = self.containment.popitem(last=False)
+      self.containment_bytes -= evicted.nbytes
+    return is_match
+
+  def _chunks(self, name):
+    # The word set `name` as Arrow slices of `chunk_size` words (views, not copies).
+    column = self.word_sets[name]
+    for start in range(0, len(column), self.chunk_size):
+      yield column.slice(start, self.chunk_size)
+
+  def _fingerprints(self, name, fingerprinter):
+    # Least recently used fingerprints are evicted first.
+    key = (name, nutella.fingerprinter_digest(fingerprinter))
+    if key in self.fingerprints:
+      self.fingerprints.move_to_end(key)
+      return self.fingerprints[key]
+
+    if name in self.index_sources:
+      db_path, tn, cn, index_dir = self.index_sources[name]
+      imdb_con = utils.open_duckdb(db_path, read_only=True, num_threads=1)
+      fingerprints, _ = fetch_fingerprints(imdb_con, tn, cn, fingerprinter, index_dir=index_dir, db_path=db_path)
+      imdb_con.close()
+    else:
+      fingerprints = fingerprinter.build_batch(self.word_sets[name])
+
+    self.fingerprints[key] = fingerprints
+    if len(self.fingerprints) > self.max_cached_fingerprints:
+      self.fingerprints.popitem(last=False)
+    return fingerprints
+
+  def run_workload(self, name, queries, partition):
+  # Same as `nutella.run_workload_with_duckdb` over the word set `name`.
+    fingerprinter = nutella.fetch_fingerprinter(partition)
+    fingerprints = self._fingerprints(name, fingerprinter)
+    masks = fingerprinter.build_mask_batch(queries)
+    is_match = self._containment(name, queries)
+
+    # Test all masks against all fingerprints (chunked to bound the memory).
+    num_fps = np.zeros(len(queries), dtype=np.int64)
+    num_negs = np.zeros(len(queries), dtype=np.int64)
+    for start, column in zip(range(0, len(fingerprints), self.chunk_size), self._chunks(name)):
+      end = start + self.chunk_size
+      chunk_match = is_match[:, start:end] if is_match is not None else batch_containment(column, queries)
+      nutella_match = nutella.match_fingerprints(fingerprints[start:end], masks)
+      num_fps += np.count_nonzero(nutella_match & ~chunk_match, axis=1)
+      num_negs += np.count_nonzero(~chunk_match, axis=1)
+
+    return [
+      {
+        '#FPs' : int(num_fps[idx]),
+        '#Ns' : int(num_negs[idx])
+      }
+      for idx in range(len(queries))
+    ]
+
+  def _cache_key(self, name, queries, partition):
+    # All session evaluators compute the same (exact) FPR, so they share the cache entries.
+    return fprcache.evaluation_key(partition, self.word_keys[name], queries, 'fpr')
+
+  def _cached_fpr(self, name, queries, partition):
+    if self.cache is None:
+      return None
+    value = self.cache.get(self._cache_key(name, queries, partition))
+    return None if value is None else value['fpr']
+
+  def _cache_fpr(self, name, queries, partition, fpr):
+    if self.cache is not None:
+      self.cache.put(self._cache_key(name, queries, partition), { 'fpr' : fpr })
+
+  def compute_fprs(self, name, queries, partitions, verbose=False):
+  # The FPRs of several (byte) partitions, in a single pass over the word set `name`.
+    print(f'word-set={name}, len(words)={self._num_words(name)}, len(patterns)={len(queries)}, len(partitions)={len(partitions)}')
+
+    # Only evaluate the partitions not in the cache.
+    fprs = [self._cached_fpr(name, queries, partition) for partition in partitions]
+    todo = [idx for idx, fpr in enumerate(fprs) if fpr is None]
+    if verbose:
+      print(f'# [word-set={name}] => {len(partitions) - len(todo)} / {len(partitions)} FPRs cached')
+    if not todo:
+      return fprs
+
+    todo_partitions = [partitions[idx] for idx in todo]
+    is_match = self._containment(name, queries) if name in self.word_sets else None
+    if name in self.stream_sources:
+      todo_fprs = self._stream_fprs(name, queries, todo_partitions, verbose=verbose)
+    elif is_match is not None:
+      todo_fprs = nutella.run_mechanism_multi(self.word_sets[name], queries, todo_partitions, is_match=is_match, verbose=verbose)
+    else:
+      # Too large to hold the containment: count chunk by chunk (as a streamed column).
+      num_fps, num_negs = stream_workload(self._chunks(name), queries, todo_partitions)
+      todo_fprs = agg_stream_fprs(num_fps, num_negs, f'word-set={name}', verbose=verbose)
+    for idx, fpr in zip(todo, todo_fprs):
+      fprs[idx] = fpr
+      self._cache_fpr(name, queries, partitions[idx], fpr)
+    return fprs
+
+  def compute_fpr(self, name, queries, partition, verbose=False):
+    print(f'word-set={name}, len(words)={self._num_words(name)}, len(patterns)={len(queries)}')
+
+    # Cached?
+    fpr = self._cached_fpr(name, queries, partition)
+    if fpr is not None:
+      if verbose:
+        print(f'# [|workload|={len(queries)}] => FPR={fpr} (cached)')
+      return fpr
+
+    # Streamed?
+    if name in self.stream_sources:
+      fpr = self._stream_fprs(name, queries, [partition], verbose=verbose)[0]
+      self._cache_fpr(name, queries, partition, fpr)
+      return fpr
+
+    # Run the experiment.
+    info = self.run_workload(name, queries, partition)
+
+    # Aggregate.
+    num_fps, num_negs, fpr = nutella.agg_info(info)
+
+    # Optional logging
+    if verbose:
+      print(f'# [|workload|={len(queries)}] => #TNS={num_negs - num_fps}, #FPs={num_fps}, #Ns={num_negs}, FPR={fpr}')
+
+    self._cache_fpr(name, queries, partition, fpr)
+    return fpr
+
+def compute_fprs_for_entries(entries, train_queries, test_queries, session, generalization=False, table_generalization=False, verbose=False):
+# Same as `compute_fpr_for_entry` for all `(index, timestamp, partition, solution_value)`-entries, evaluated together.
+  partitions = [partition for _, _, partition, _ in entries]
+
+  train_fprs = session.compute_fprs('train', train_queries, partitions, verbose=verbose)
+  val_fprs = session.compute_fprs('all', train_queries, partitions, verbose=verbose)
+  test_fprs = session.compute_fprs('all', test_queries, partitions, verbose=verbose) if generalization else [None] * len(entries)
+
+  table_val_fprs, table_test_fprs = [None] * len(entries), [None] * len(entries)
+  if table_generalization:
+    table_val_fprs = session.compute_fprs('table', train_queries, partitions, verbose=verbose)
+    table_test_fprs = session.compute_fprs('table', test_queries, partitions, verbose=verbose)
+
+  return [
+    {
+      'index': index,
+      'timestamp': timestamp,
+      'solution_value': solution_value,
+      'train-fpr': train_fprs[idx],
+      'val-fpr': val_fprs[idx],
+      'test-fpr': test_fprs[idx],
+      'table-val-fpr' : table_val_fprs[idx],
+      'table-test-fpr' : table_test_fprs[idx],
+    }
+    for idx, (index, timestamp, _, solution_value) in enumerate(entries)
+  ]
+
+def compute_fpr_for_entry(index, num_partitions, tn, cn, timestamp, partition, solution_value, train_words, train_queries, all_words, test_queries, generalization=False, table_generalization=False, verbose=False, index_dir=None, backend='duckdb', session=None):
   if index is not None:
     print(f'\n👷 Computing train/val/test FPRs for partition {index + 1} / {num_partitions}..')
 
-  train_fpr = compute_fpr(train_words, train_queries, partition, verbose=verbose)
-  val_fpr = compute_fpr(all_words, train_queries, partition, verbose=verbose)
+  # With a session, the word sets are `train`, `all` and `table` (loaded once).
+  if session is not None:
+    train_fpr = session.compute_fpr('train', train_queries, partition, verbose=verbose)
+    val_fpr = session.compute_fpr('all', train_queries, partition, verbose=verbose)
+    test_fpr = session.compute_fpr('all', test_queries, partition, verbose=verbose) if generalization else None
+
+    table_val_fpr, table_test_fpr = None, None
+    if table_generalization:
+      table_val_fpr = session.compute_fpr('table', train_queries, partition, verbose=verbose)
+      table_test_fpr = session.compute_fpr('table', test_queries, partition, verbose=verbose)
+  else:
+    train_fpr = compute_fpr(train_words, train_queries, partition, verbose=verbose, backend=backend)
+    val_fpr = compute_fpr(all_words, train_queries, partition, verbose=verbose, backend=backend)
 
-  test_fpr = None
-  if generalization:
-    test_fpr = compute_fpr(all_words, test_queries, partition, verbose=verbose)
+    test_fpr = None
+    if generalization:
+      test_fpr = compute_fpr(all_words, test_queries, partition, verbose=verbose, backend=backend)
 
-  table_val_fpr, table_test_fpr = None, None
-  if table_generalization:
-    table_val_fpr = compute_table_fpr(tn, cn, train_queries, partition, verbose=verbose)
-    table_test_fpr = compute_table_fpr(tn, cn, test_queries, partition, verbose=verbose)
+    table_val_fpr, table_test_fpr = None, None
+    if table_generalization:
+      table_val_fpr = compute_table_fpr(tn, cn, train_queries, partition, verbose=verbose, index_dir=index_dir, backend=backend)
+      table_test_fpr = compute_table_fpr(tn, cn, test_queries, partition, verbose=verbose, index_dir=index_dir, backend=backend)
 
   return {
     'index': index,
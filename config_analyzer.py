@@ -23,8 +23,8 @@ class ConfigAnalyzer:
     # Train queries.
     train_queries = self.config['patterns_in_optimization']
 
-    # Full block.
-    all_words = utils.read_words(self.config['configuration']['file_path_words'].replace('data/', ''))
+    # Full block (packed into an arena, it is only fingerprinted and matched).
+    all_words = utils.read_words(self.config['configuration']['file_path_words'].replace('data/', ''), as_arena=True)
 
     # All queries.
     all_queries = utils.read_words(self.config['configuration']['file_path_patterns'].replace('data/', ''), strip_spaces=False)
@@ -0,0 +1,66 @@
+import numpy as np
+
+class PatternAutomaton:
+# Aho-Corasick automaton over the UTF-8 bytes of a set of patterns.
+  def __init__(self, patterns):
+    self.patterns = list(patterns)
+
+    # Build the trie.
+    goto, outputs = [{}], [[]]
+    for pattern_idx, pattern in enumerate(self.patterns):
+      state = 0
+      for byte in pattern.encode('utf-8'):
+        if byte not in goto[state]:
+          goto.append({})
+          outputs.append([])
+          goto[state][byte] = len(goto) - 1
+        state = goto[state][byte]
+      outputs[state].append(pattern_idx)
+
+    # Compute the failure links (BFS) and fold them into a dense transition table.
+    self.delta = [[0] * 256 for _ in goto]
+    for byte, child in goto[0].items():
+      self.delta[0][byte] = child
+    fail = [0] * len(goto)
+    queue = list(goto[0].values())
+    for state in queue:
+      outputs[state] = outputs[state] + outputs[fail[state]]
+      row, fail_row = self.delta[state], self.delta[fail[state]]
+      for byte in range(256):
+        row[byte] = fail_row[byte]
+      for byte, child in goto[state].items():
+        fail[child] = fail_row[byte]
+        row[byte] = child
+        queue.append(child)
+
+    # Outputs per state, including the ones reachable via failure links.
+    self.outputs = [tuple(output) for output in outputs]
+
+  def matches(self, text):
+  # Returns the indices of all patterns contained in `text` (a string or its UTF-8 bytes).
+    delta, outputs = self.delta, self.outputs
+    ret = set(outputs[0])
+    state = 0
+    for byte in (text.encode('utf-8') if isinstance(text, str) else text):
+      state = delta[state][byte]
+      if outputs[state]:
+        ret.update(outputs[state])
+    return ret
+
+def containment_matrix(words, patterns):
+# Returns the |patterns| x |words| matrix telling whether a pattern is contained in a word.
+  automaton = PatternAutomaton(patterns)
+
+  # Run the automaton once per distinct word (string arenas are matched on their bytes).
+  word_ids = {}
+  values = words.iter_bytes() if hasattr(words, 'iter_bytes') else words
+  column = np.fromiter((word_ids.setdefault(word, len(word_ids)) for word in values), dtype=np.int64, count=len(words))
+  distinct_words = list(word_ids.keys())
+
+  distinct_contained = np.zeros((len(automaton.patterns), len(distinct_words)), dtype=bool)
+  for word_idx, word in enumerate(distinct_words):
+    for pattern_idx in automaton.matches(word):
+      distinct_contained[pattern_idx, word_idx] = True
+
+  # And scatter back to all words.
+  return distinct_contained[:, column]
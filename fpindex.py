@@ -0,0 +1,93 @@
+import os
+import json
+import struct
+import numpy as np
+import nutella
+
+# File layout: magic | version (uint32) | header length (uint32) | JSON header | padding | fingerprints.
+MAGIC = b'NUTFPIDX'
+VERSION = 1
+ALIGNMENT = 64
+INDEX_DIR = './indexes'
+
+def index_path(index_dir, tn, cn, partition):
+  # One index per (table, column, fingerprint function).
+  return os.path.join(index_dir, f'{tn}-{cn}-{nutella.fingerprinter_digest(partition)[:16]}.nfp')
+
+def write_index(path, fingerprints, partition, tn=None, cn=None, source=None):
+  fingerprinter = nutella.fetch_fingerprinter(partition)
+  fingerprints = np.ascontiguousarray(fingerprints, dtype=np.dtype(nutella.fingerprint_dtype(fingerprinter.num_bins)).newbyteorder('<'))
+
+  # The header.
+  header = {
+    'table' : tn,
+    'column' : cn,
+    'num_bins' : fingerprinter.num_bins,
+    'num_words' : nutella.fingerprint_num_words(fingerprinter.num_bins),
+    'dtype' : fingerprints.dtype.str,
+    'num_rows' : len(fingerprints),
+    # The digest of the indexed data (see `fprcache.table_digest`).
+    'source' : source,
+    'digest' : nutella.fingerprinter_digest(fingerprinter),
+    'spec' : fingerprinter.spec()
+  }
+  header_bytes = json.dumps(header).encode('utf-8')
+  prefix = MAGIC + struct.pack('<II', VERSION, len(header_bytes)) + header_bytes
+  padding = b'\0' * (-len(prefix) % ALIGNMENT)
+
+  # Write to a temporary file first, so readers never see a partial index.
+  os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(prefix + padding)
+    f.write(fingerprints.tobytes())
+  os.replace(tmp_path, path)
+  return header
+
+def read_header(path):
+# Returns the header and the offset of the fingerprints.
+  with open(path, 'rb') as f:
+    magic = f.read(len(MAGIC))
+    assert magic == MAGIC, f'{path} is not a fingerprint index!'
+    version, header_length = struct.unpack('<II', f.read(8))
+    assert version == VERSION, f'Unsupported index version: {version}'
+    header = json.loads(f.read(header_length).decode('utf-8'))
+  data_offset = len(MAGIC) + 8 + header_length
+  data_offset += -data_offset % ALIGNMENT
+  return header, data_offset
+
+def is_current(header, source, num_rows):
+  # Whether the index was built from the data it is used with; a rebuilt database has another digest (or row count).
+  return header.get('source') == source and header['num_rows'] == num_rows
+
+def read_index(path, partition=None, source=None, num_rows=None):
+# Returns the header and the (memory-mapped) fingerprints.
+  header, data_offset = read_header(path)
+
+  # Make sure the index was built by the same fingerprint function.
+  if partition is not None:
+    assert header['digest'] == nutella.fingerprinter_digest(partition), f'{path} was built with another partition!'
+
+  # And from the same data (the fingerprints are joined to the rows by position).
+  if source is not None:
+    assert is_current(header, source, num_rows), f'{path} was built from other data ({header["num_rows"]} rows), rebuild it!'
+
+  # Zero-copy: only the pages touched are read.
+  shape = (header['num_rows'],) if header['num_words'] == 1 else (header['num_rows'], header['num_words'])
+  if not header['num_rows']:
+    return header, np.zeros(shape, dtype=np.dtype(header['dtype']))
+  return header, np.memmap(path, dtype=np.dtype(header['dtype']), mode='r', offset=data_offset, shape=shape)
+
+def build_index(path, column, partition, tn=None, cn=None, source=None):
+  # Fingerprint the column and persist the fingerprints.
+  fingerprinter = nutella.fetch_fingerprinter(partition)
+  write_index(path, fingerprinter.build_batch(column), fingerprinter, tn=tn, cn=cn, source=source)
+  return read_index(path)
+
+def register_index(con, name, fingerprints, num_bins, fp_name='word_fp'):
+# Registers the fingerprints as an Arrow table; returns the SQL expression of the fingerprint.
+  import pyarrow as pa
+
+  fp_columns, fp_expr = nutella.fingerprint_columns(fingerprints, num_bins, fp_name)
+  con.register(name, pa.table({key : pa.array(np.asarray(values)) for key, values in fp_columns.items()}))
+  return fp_expr
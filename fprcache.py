@@ -0,0 +1,131 @@
+import os
+import json
+import fcntl
+import hashlib
+import contextlib
+import nutella
+
+# One JSON file per evaluation, named by the hash of what the evaluation depends on.
+CACHE_DIR = './cache/fprs'
+MAX_CACHE_BYTES = 2**28
+LOCK_NAME = '.lock'
+
+# A full cache is evicted down to this fraction of its bound, so that it is not rescanned on every write.
+EVICT_TARGET = 0.9
+# The writes of the other processes are only seen by a rescan, which happens at least every so many writes.
+EVICT_EVERY = 256
+
+def words_digest(words):
+# The digest of an (ordered) list of strings.
+  hasher = hashlib.sha256()
+  values = words.iter_bytes() if hasattr(words, 'iter_bytes') else (word.encode('utf-8') for word in words)
+  for data in values:
+    # Length-prefixed, so that the boundaries between the words count as well.
+    hasher.update(len(data).to_bytes(8, 'little'))
+    hasher.update(data)
+  return hasher.hexdigest()
+
+def table_digest(db_path, tn, cn):
+# The digest of the (ASCII) values of column `cn` of table `tn`; a rewritten database gets another one.
+  stat = os.stat(db_path)
+  return hashlib.sha256(json.dumps({
+    'db_path' : os.path.abspath(db_path),
+    'size' : stat.st_size,
+    'mtime' : stat.st_mtime_ns,
+    'table' : tn,
+    'column' : cn,
+    'filter' : 'ascii'
+  }, sort_keys=True).encode('utf-8')).hexdigest()
+
+def evaluation_key(partition, words_key, queries, evaluator):
+# The key of evaluating the `queries` over the word set `words_key` (see `words_digest` and `table_digest`).
+  return hashlib.sha256(json.dumps({
+    'partition' : nutella.fingerprinter_digest(partition),
+    'words' : words_key,
+    'queries' : words_digest(queries),
+    'evaluator' : evaluator
+  }, sort_keys=True).encode('utf-8')).hexdigest()
+
+class FPRCache:
+# A persistent, size-bounded cache of evaluation results; safe to share between processes.
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # A running estimate of the cache size (exact after each rescan, see `evict`).
+    self.estimated_bytes = None
+    self.num_puts = 0
+
+  def _path(self, key):
+    # Fan out, so that no directory gets too large.
+    return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+  @contextlib.contextmanager
+  def _lock(self):
+    with open(os.path.join(self.cache_dir, LOCK_NAME), 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def get(self, key):
+  # Returns the cached value of `key` (`None` if there is none).
+    path = self._path(key)
+    try:
+      with open(path, 'r') as f:
+        value = json.load(f)
+
+      # Mark as recently used; the least recently used entries are evicted first.
+      os.utime(path)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+    return value
+
+  def put(self, key, value):
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first, so readers never see a partial entry.
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(value, f)
+    num_bytes = os.stat(tmp_path).st_size
+    try:
+      num_bytes -= os.stat(path).st_size
+    except FileNotFoundError:
+      pass
+    os.replace(tmp_path, path)
+
+    # Only rescan once the estimate exceeds the bound (or the other processes may have written a lot).
+    self.num_puts += 1
+    if self.estimated_bytes is not None:
+      self.estimated_bytes += num_bytes
+    if self.estimated_bytes is None or self.estimated_bytes > self.max_bytes or self.num_puts % EVICT_EVERY == 0:
+      self.evict()
+
+  def evict(self):
+  # Drops the least recently used entries, down to `EVICT_TARGET * max_bytes`, if the cache exceeds `max_bytes`.
+    with self._lock():
+      entries = []
+      for root, _, file_names in os.walk(self.cache_dir):
+        for file_name in file_names:
+          if not file_name.endswith('.json'):
+            continue
+          path = os.path.join(root, file_name)
+          try:
+            stat = os.stat(path)
+          except FileNotFoundError:
+            continue
+          entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+      total_bytes = sum(size for _, size, _ in entries)
+      if total_bytes > self.max_bytes:
+        for _, size, path in sorted(entries):
+          if total_bytes <= EVICT_TARGET * self.max_bytes:
+            break
+          with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+          total_bytes -= size
+      self.estimated_bytes = total_bytes
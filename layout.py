@@ -0,0 +1,102 @@
+import numpy as np
+import nutella
+import zonemap
+
+LAYOUT_METHODS = ['sort', 'gray', 'greedy']
+
+def _as_words(fingerprints):
+  # Fingerprints as (rows, words) array; the last word is the most significant one.
+  fingerprints = np.asarray(fingerprints)
+  if fingerprints.ndim == 1:
+    return fingerprints[:, None]
+  return fingerprints
+
+def _lexsort(words):
+  # `np.lexsort` takes the last key as the primary one.
+  return np.lexsort([words[:, idx] for idx in range(words.shape[1])])
+
+def gray_rank(fingerprints):
+# Returns the rank of each fingerprint in the (reflected) Gray code sequence.
+  words = _as_words(fingerprints).astype(np.uint64)
+  ranks = np.zeros_like(words)
+
+  # Prefix-XOR from the most significant bit on, carrying the parity of the higher words.
+  higher_parity = np.zeros(len(words), dtype=bool)
+  for idx in reversed(range(words.shape[1])):
+    rank = words[:, idx].copy()
+    shift = 1
+    while shift < 64:
+      rank ^= rank >> np.uint64(shift)
+      shift <<= 1
+    ranks[:, idx] = np.where(higher_parity, ~rank, rank)
+    higher_parity ^= (nutella.compute_fingerprint_densities(words[:, idx]) % 2).astype(bool)
+  return ranks
+
+def greedy_blocks(fingerprints, block_size):
+# Assigns the rows to blocks such that the block summaries grow as little as possible.
+  words = _as_words(fingerprints)
+  distinct, inverse, counts = np.unique(words, axis=0, return_inverse=True, return_counts=True)
+  inverse = inverse.ravel()
+
+  num_blocks = (len(words) + block_size - 1) // block_size
+  summaries = np.zeros((num_blocks, words.shape[1]), dtype=words.dtype)
+  free = np.full(num_blocks, block_size, dtype=np.int64)
+  free[-1] = len(words) - (num_blocks - 1) * block_size if num_blocks else 0
+
+  # The most frequent fingerprints first; their rows may spill over several blocks.
+  block_of_distinct = [[] for _ in range(len(distinct))]
+  for distinct_idx in np.argsort(-counts, kind='stable'):
+    remaining = counts[distinct_idx]
+    while remaining > 0:
+      # The growth of each block's summary (full blocks are out), ties go to the fuller block.
+      growth = nutella.compute_fingerprint_densities(summaries | distinct[distinct_idx]) - nutella.compute_fingerprint_densities(summaries)
+      growth = np.where(free > 0, growth, np.iinfo(np.int64).max)
+      block_idx = np.lexsort((free, growth))[0]
+
+      taken = min(remaining, free[block_idx])
+      block_of_distinct[distinct_idx].append((block_idx, taken))
+      summaries[block_idx] |= distinct[distinct_idx]
+      free[block_idx] -= taken
+      remaining -= taken
+
+  # Hand out the rows of each fingerprint to its blocks.
+  block_of_row = np.zeros(len(words), dtype=np.int64)
+  rows_of_distinct = np.split(np.argsort(inverse, kind='stable'), np.cumsum(counts)[:-1])
+  for distinct_idx, rows in enumerate(rows_of_distinct):
+    start = 0
+    for block_idx, taken in block_of_distinct[distinct_idx]:
+      block_of_row[rows[start:start + taken]] = block_idx
+      start += taken
+  return block_of_row
+
+def reorder(fingerprints, method='sort', block_size=zonemap.DEFAULT_BLOCK_SIZE):
+# Returns the row permutation that clusters similar fingerprints.
+  assert method in LAYOUT_METHODS, f'Unknown layout method: {method}'
+  if method == 'sort':
+    return _lexsort(_as_words(fingerprints))
+  if method == 'gray':
+    return _lexsort(gray_rank(fingerprints))
+  return np.argsort(greedy_blocks(fingerprints, block_size), kind='stable')
+
+def run_workload(words, workload, partition=None, num_bins=None, method='sort', block_size=zonemap.DEFAULT_BLOCK_SIZE):
+# Reorders the words by their fingerprints and reports the per-pattern block skipping.
+  # Fetch the fingerprinter.
+  fingerprinter = nutella.fetch_fingerprinter(partition, num_bins=num_bins)
+
+  # Compute the layout.
+  permutation = reorder(fingerprinter.build_batch(words), method=method, block_size=block_size)
+
+  # And evaluate the zonemap on the reordered words.
+  return zonemap.run_workload([words[idx] for idx in permutation], workload, partition=fingerprinter, block_size=block_size)
+
+def run_mechanism(words, workload, partition, method='sort', block_size=zonemap.DEFAULT_BLOCK_SIZE, verbose=False):
+  # Run all patterns at once.
+  info = run_workload(words, workload, partition=partition, method=method, block_size=block_size)
+
+  # Aggregate.
+  num_skipped, num_blocks, skip_rate, bytes_avoided = zonemap.agg_info(info)
+
+  if verbose:
+    print(f'# [|words|={len(words)} |workload|={len(workload)} method={method} block_size={block_size}] => #skipped={num_skipped}, #blocks={num_blocks}, skip-rate={skip_rate}, bytes-avoided={bytes_avoided}')
+
+  return skip_rate
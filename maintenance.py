@@ -0,0 +1,205 @@
+import json
+import numpy as np
+import pandas as pd
+import nutella
+import zonemap
+
+# The bookkeeping tables of a maintained (table, fingerprint column), e.g., `nutella_zonemap_tab_nutella`.
+VERSIONS_TABLE = 'nutella_versions_{tn}_{fp}'
+ZONEMAP_TABLE = 'nutella_zonemap_{tn}_{fp}'
+DEFAULT_BATCH_SIZE = 2**16
+
+class FingerprintMaintainer:
+# Keeps the fingerprint column (and its block zonemap) of a table up to date under appends, updates and deletes.
+  def __init__(self, con, partition, tn='tab', raw='raw', fp='nutella', packed=False, block_size=zonemap.DEFAULT_BLOCK_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    self.con = con
+    self.tn, self.raw, self.fp = tn, raw, fp
+    self.block_size, self.batch_size = block_size, batch_size
+    self.versions_table = VERSIONS_TABLE.format(tn=tn, fp=fp)
+    self.zonemap_table = ZONEMAP_TABLE.format(tn=tn, fp=fp)
+
+    # Fetch the fingerprinter.
+    self.fingerprinter = nutella.fetch_fingerprinter(partition)
+    self.num_bins = self.fingerprinter.num_bins
+    self.sql_type = nutella.fingerprint_sql_type(self.num_bins, packed=packed)
+
+    # The bookkeeping columns and tables.
+    con.execute(f'''
+      ALTER TABLE {tn} ADD COLUMN IF NOT EXISTS {fp}_version INTEGER;
+      ALTER TABLE {tn} ADD COLUMN IF NOT EXISTS {fp}_block BIGINT;
+      CREATE TABLE IF NOT EXISTS {self.versions_table} (
+        version INTEGER,
+        digest TEXT,
+        num_bins INTEGER,
+        spec TEXT
+      );
+      CREATE TABLE IF NOT EXISTS {self.zonemap_table} (
+        block_id BIGINT,
+        summary {self.sql_type},
+        num_rows BIGINT,
+        dirty BOOLEAN
+      );
+    ''')
+
+    # Another width? Then all the fingerprints and summaries are stale anyway.
+    if self._column_type(tn, fp) != self.sql_type:
+      con.execute(f'''
+        ALTER TABLE {tn} ALTER {fp} SET DATA TYPE {self.sql_type} USING NULL;
+        UPDATE {tn} SET {fp}_version = NULL;
+      ''')
+    if self._column_type(self.zonemap_table, 'summary') != self.sql_type:
+      con.execute(f'''
+        ALTER TABLE {self.zonemap_table} ALTER summary SET DATA TYPE {self.sql_type} USING NULL;
+        UPDATE {self.zonemap_table} SET dirty = TRUE;
+      ''')
+
+    # Register the partition version.
+    self.version = self._register_version()
+
+  def _column_type(self, tn, cn):
+    return self.con.execute(f'SELECT data_type FROM information_schema.columns WHERE table_name = ? AND column_name = ?;', [tn, cn]).fetchone()[0]
+
+  def _register_version(self):
+    # The same fingerprint function always gets the same version.
+    digest = nutella.fingerprinter_digest(self.fingerprinter)
+    ret = self.con.execute(f'SELECT version FROM {self.versions_table} WHERE digest = ?;', [digest]).fetchone()
+    if ret is not None:
+      return ret[0]
+
+    version = self.con.execute(f'SELECT coalesce(max(version), 0) + 1 FROM {self.versions_table};').fetchone()[0]
+    self.con.execute(f'INSERT INTO {self.versions_table} VALUES (?, ?, ?, ?);', [version, digest, self.num_bins, json.dumps(self.fingerprinter.spec())])
+    return version
+
+  def refresh(self):
+  # Fingerprints the rows not indexed under the current version (new, changed or indexed under another partition), batch by batch.
+    num_refreshed = 0
+    while True:
+      batch = self.con.execute(f'''
+        SELECT rowid AS row_id, {self.raw} AS raw, {self.fp}_block AS block_id
+        FROM {self.tn}
+        WHERE {self.fp}_version IS DISTINCT FROM {self.version}
+        ORDER BY rowid
+        LIMIT {self.batch_size};
+      ''').fetch_arrow_table()
+      if not batch.num_rows:
+        return num_refreshed
+      self._refresh_batch(batch)
+      num_refreshed += batch.num_rows
+
+  def _refresh_batch(self, batch):
+    # Fingerprint the batch.
+    fp_columns, fp_expr = nutella.fingerprint_columns(self.fingerprinter.build_batch(batch.column('raw')), self.num_bins, 'fp')
+
+    # New rows fill up the blocks in their order of arrival.
+    block_ids = batch.column('block_id').to_numpy(zero_copy_only=False)
+    is_new = pd.isna(block_ids)
+    next_position = self.con.execute(f'SELECT coalesce(sum(num_rows), 0) FROM {self.zonemap_table};').fetchone()[0]
+    block_ids = np.where(is_new, 0, block_ids).astype(np.int64)
+    block_ids[is_new] = (next_position + np.arange(np.count_nonzero(is_new))) // self.block_size
+
+    batch_df = pd.DataFrame({
+      'row_id' : batch.column('row_id').to_numpy(),
+      'block_id' : block_ids,
+      'is_new' : is_new,
+      **fp_columns
+    })
+    self.con.register('nutella_batch', batch_df)
+    self.con.execute(f'''
+      CREATE OR REPLACE TEMPORARY TABLE nutella_batch_fps AS
+      SELECT row_id, block_id, is_new, CAST({fp_expr} AS {self.sql_type}) AS fp
+      FROM nutella_batch;
+    ''')
+    self.con.unregister('nutella_batch')
+
+    self.con.execute(f'''
+      -- Write the fingerprints.
+      UPDATE {self.tn}
+      SET {self.fp} = b.fp, {self.fp}_version = {self.version}, {self.fp}_block = b.block_id
+      FROM nutella_batch_fps b
+      WHERE {self.tn}.rowid = b.row_id;
+
+      -- Appends: OR the new fingerprints into their block summaries.
+      UPDATE {self.zonemap_table}
+      SET summary = {self.zonemap_table}.summary | d.summary, num_rows = {self.zonemap_table}.num_rows + d.num_rows
+      FROM (SELECT block_id, bit_or(fp) AS summary, COUNT(*) AS num_rows FROM nutella_batch_fps WHERE is_new GROUP BY block_id) d
+      WHERE {self.zonemap_table}.block_id = d.block_id;
+
+      INSERT INTO {self.zonemap_table}
+      SELECT block_id, bit_or(fp), COUNT(*), FALSE
+      FROM nutella_batch_fps
+      WHERE is_new AND block_id NOT IN (SELECT block_id FROM {self.zonemap_table})
+      GROUP BY block_id;
+
+      -- Changed rows: their old fingerprints may still be in the summaries.
+      UPDATE {self.zonemap_table}
+      SET dirty = TRUE
+      WHERE block_id IN (SELECT block_id FROM nutella_batch_fps WHERE NOT is_new);
+
+      DROP TABLE nutella_batch_fps;
+    ''')
+
+  def append(self, values):
+  # Appends the strings `values` and fingerprints them.
+    self.con.register('nutella_append', pd.DataFrame({ 'raw' : list(values) }))
+    self.con.execute(f'INSERT INTO {self.tn} ({self.raw}) SELECT raw FROM nutella_append;')
+    self.con.unregister('nutella_append')
+    return self.refresh()
+
+  def update(self, set_sql, where_sql):
+  # Updates the rows matching `where_sql` and re-fingerprints them.
+    self.con.execute(f'''
+      UPDATE {self.tn}
+      SET {set_sql}, {self.fp}_version = NULL
+      WHERE {where_sql};
+    ''')
+    return self.refresh()
+
+  def delete(self, where_sql):
+  # Deletes the rows matching `where_sql`; the summaries of their blocks are recomputed lazily.
+    self.con.execute(f'''
+      UPDATE {self.zonemap_table}
+      SET dirty = TRUE
+      WHERE block_id IN (SELECT {self.fp}_block FROM {self.tn} WHERE {where_sql});
+
+      DELETE FROM {self.tn}
+      WHERE {where_sql};
+    ''')
+
+  def recompute_dirty_blocks(self):
+  # Recomputes the summaries of the dirty blocks from their (current) rows.
+    self.refresh()
+    self.con.execute(f'''
+      UPDATE {self.zonemap_table}
+      SET summary = d.summary, dirty = FALSE
+      FROM (
+        SELECT {self.fp}_block AS block_id, bit_or({self.fp}) AS summary
+        FROM {self.tn}
+        WHERE {self.fp}_block IN (SELECT block_id FROM {self.zonemap_table} WHERE dirty)
+        GROUP BY {self.fp}_block
+      ) d
+      WHERE {self.zonemap_table}.block_id = d.block_id;
+
+      -- Blocks without any rows left.
+      UPDATE {self.zonemap_table}
+      SET summary = {nutella.fingerprint_sql_literal(0, self.num_bins)}, dirty = FALSE
+      WHERE dirty;
+    ''')
+
+  def candidate_blocks(self, pattern):
+  # Returns the blocks that may contain `pattern`.
+    self.recompute_dirty_blocks()
+    mask = nutella.fingerprint_sql_literal(self.fingerprinter.build_mask(pattern), self.num_bins)
+    return [block_id for (block_id,) in self.con.execute(f'''
+      SELECT block_id
+      FROM {self.zonemap_table}
+      WHERE (summary & {mask}) = {mask}
+      ORDER BY block_id;
+    ''').fetchall()]
+
+  def version_counts(self):
+  # The number of rows indexed under each partition version (`None`: not indexed yet).
+    return dict(self.con.execute(f'''
+      SELECT {self.fp}_version, COUNT(*)
+      FROM {self.tn}
+      GROUP BY {self.fp}_version;
+    ''').fetchall())
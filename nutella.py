@@ -1,10 +1,14 @@
 import utils
+import containment
 import statistics
+import hashlib
+import json
 import random
 import math
 import sys
 import os
 import duckdb
+import numpy as np
 import pandas as pd
 
 def read_partition(partition_file):
@@ -32,6 +36,13 @@ def revert_byte_mapping(partition):
     ret[partition[key]].append(key)
   return ret
 
+def get_num_bins(partition, num_bins=None):
+  # The default partition.
+  if partition is None:
+    assert num_bins is not None
+    return num_bins
+  return max(int(bin_idx) for bin_idx in partition) + 1
+
 def fetch_byte_mapping(pattern, partition, num_bins=None):
   # Return the default one.
   if partition is None:
@@ -65,6 +76,592 @@ def compute_fingerprint_density(fingerprint):
     fingerprint &= (fingerprint - 1)
   return count
 
+def compile_lut(partition, num_bins=None):
+# Compiles the partition into a uint8[256] byte -> bin lookup table.
+  # Fetch the alphabet mapping.
+  byte_mapping = fetch_byte_mapping(None, partition, num_bins=num_bins)
+
+  # Bytes outside the partition stay unmapped (and are rejected when building).
+  lut = np.zeros(256, dtype=np.uint8)
+  mapped = np.zeros(256, dtype=bool)
+  for byte, bin_idx in byte_mapping.items():
+    # Code points beyond a byte never occur in the UTF-8 data (as in `build_fingerprint`).
+    if byte >= 256:
+      continue
+    assert 0 <= bin_idx < 256, f'Bin {bin_idx} does not fit into the lookup table!'
+    lut[byte] = bin_idx
+    mapped[byte] = True
+  return lut, mapped
+
+def fingerprint_num_words(num_bins):
+  # Number of 64-bit words a fingerprint with `num_bins` bins occupies.
+  return max(1, (num_bins + 63) // 64)
+
+def fingerprint_dtype(num_bins):
+  # NOTE: Wider fingerprints are stored as multiple `uint64`-words per row.
+  return np.uint32 if num_bins <= 32 else np.uint64
+
+def fingerprint_sql_type(num_bins, packed=False):
+  # Packed storage: the narrowest integer holding all bins.
+  if packed and num_bins <= 8:
+    return 'UTINYINT'
+  if packed and num_bins <= 16:
+    return 'USMALLINT'
+  if num_bins <= 32:
+    return 'UINTEGER'
+  if num_bins <= 64:
+    return 'UBIGINT'
+  if num_bins <= 128:
+    return 'UHUGEINT'
+  return 'BIT'
+
+def fingerprint_sql_value(fingerprint, num_bins):
+  # Python value DuckDB converts into `fingerprint_sql_type(num_bins)`.
+  if fingerprint_sql_type(num_bins) == 'BIT':
+    return format(fingerprint, f'0{num_bins}b')
+  if num_bins > 64:
+    # Python ints go through a double on their way to UHUGEINT; strings do not.
+    return str(fingerprint)
+  return fingerprint
+
+def fingerprint_sql_literal(fingerprint, num_bins):
+  sql_type = fingerprint_sql_type(num_bins)
+  if num_bins <= 64:
+    return f'{fingerprint}'
+  return f"'{fingerprint_sql_value(fingerprint, num_bins)}'::{sql_type}"
+
+def fingerprint_columns(fingerprints, num_bins, name):
+# Returns the DataFrame columns holding `fingerprints` and the SQL expression assembling them.
+  if num_bins <= 64:
+    return {name : fingerprints}, name
+
+  # Two `UBIGINT`s make up a `UHUGEINT`.
+  if num_bins <= 128:
+    lo, hi = f'{name}_lo', f'{name}_hi'
+    return {lo : fingerprints[:, 0], hi : fingerprints[:, 1]}, f'((({hi})::UHUGEINT << 64) | ({lo})::UHUGEINT)'
+
+  # Bitstrings, the highest bin first (as in `format(fingerprint, 'b')`).
+  bits = np.unpackbits(fingerprints.astype('<u8').view(np.uint8), axis=1, bitorder='little')[:, num_bins - 1::-1]
+  chars = np.where(bits, ord('1'), ord('0')).astype(np.uint8)
+  bitstrings = np.ascontiguousarray(chars).view(f'S{num_bins}').ravel().astype(str)
+  return {name : bitstrings}, f'({name})::BIT'
+
+def column_buffers(column):
+# Returns the `(offsets, data)` buffers of a string column.
+  # Already in buffer form.
+  if isinstance(column, tuple):
+    offsets, data = column
+    return np.asarray(offsets, dtype=np.int64), np.asarray(data, dtype=np.uint8)
+
+  # String arenas (see `arena.StringArena`) hand over their buffers directly.
+  if hasattr(column, 'string_buffers'):
+    offsets, data = column.string_buffers()
+    return np.asarray(offsets, dtype=np.int64), np.asarray(data, dtype=np.uint8)
+
+  # Arrow string arrays: take the buffers as they are (zero-copy).
+  if type(column).__module__.startswith('pyarrow'):
+    import pyarrow as pa
+    if isinstance(column, pa.ChunkedArray):
+      column = column.combine_chunks()
+    assert pa.types.is_string(column.type) or pa.types.is_large_string(column.type), f'Unsupported type: {column.type}'
+    _, offsets_buf, data_buf = column.buffers()
+    offsets_dtype = np.int64 if pa.types.is_large_string(column.type) else np.int32
+    offsets = np.frombuffer(offsets_buf, dtype=offsets_dtype)[column.offset:column.offset + len(column) + 1]
+    data = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.zeros(0, dtype=np.uint8)
+    return offsets.astype(np.int64), data
+
+  # Plain Python strings (NULLs are treated as empty strings).
+  encoded = [value.encode('utf-8') if value is not None else b'' for value in column]
+  offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+  np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+  data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+  return offsets, data
+
+def build_fingerprints(column, lut, mapped=None, num_bins=None):
+# Builds the fingerprints of a whole column at once.
+  offsets, data = column_buffers(column)
+  if num_bins is None:
+    num_bins = int(lut.max()) + 1
+
+  # Only look at the bytes the column actually covers.
+  data = data[offsets[0]:offsets[-1]]
+  starts = offsets[:-1] - offsets[0]
+
+  # Make sure all bytes are covered by the partition.
+  if mapped is not None:
+    present = np.bincount(data, minlength=256) > 0
+    assert not np.any(present & ~mapped), f'Bytes: {np.flatnonzero(present & ~mapped).tolist()} are not in your mapping!'
+
+  # And OR the bits of each string together.
+  return reduce_bins(lut[data], starts, np.diff(offsets), num_bins)
+
+def reduce_bins(bins, starts, lengths, num_bins, valid=None):
+# ORs the bits of `bins` per segment (the segments tile `bins`); invalid positions are skipped.
+  dtype = fingerprint_dtype(num_bins)
+  num_words = fingerprint_num_words(num_bins)
+
+  # Translate each bin to its bit (within its 64-bit word).
+  bins = bins.astype(np.int64)
+  word_of_bin = bins // 64
+  bit_of_bin = np.left_shift(dtype(1), (bins % 64).astype(dtype))
+  if valid is not None:
+    word_of_bin[~valid] = -1
+
+  # NOTE: Empty segments have no bits.
+  fingerprints = np.zeros((len(starts), num_words), dtype=dtype)
+  non_empty = lengths > 0
+  if np.any(non_empty):
+    for word_idx in range(num_words):
+      bits = np.where(word_of_bin == word_idx, bit_of_bin, dtype(0))
+      fingerprints[non_empty, word_idx] = np.bitwise_or.reduceat(bits, starts[non_empty])
+
+  # Narrow fingerprints are plain 1-D arrays.
+  if num_words == 1:
+    return fingerprints[:, 0]
+  return fingerprints
+
+NGRAM_HASH_MULTIPLIER = 2654435761
+
+def ngram_code(ngram: bytes) -> int:
+  # The n-gram as big-endian integer.
+  return int.from_bytes(ngram, 'big')
+
+def hash_ngram_codes(codes, num_bins):
+  # Multiplicative hashing of the n-gram codes into the bins.
+  return ((np.asarray(codes, dtype=np.uint64) * np.uint64(NGRAM_HASH_MULTIPLIER)) % np.uint64(2**32)) % np.uint64(num_bins)
+
+class ByteFingerprinter:
+# The character-set fingerprint: each byte sets the bit of its bin.
+  def __init__(self, partition, num_bins=None):
+    self.partition = partition
+    self.num_bins = get_num_bins(partition, num_bins)
+    self.byte_mapping = fetch_byte_mapping(None, partition, num_bins=num_bins)
+    self.lut, self.mapped = compile_lut(partition, num_bins=num_bins)
+
+  def build(self, text: str) -> int:
+    return build_fingerprint(text, self.byte_mapping)
+
+  def build_mask(self, pattern: str) -> int:
+    return self.build(split_like_pattern(pattern)[0])
+
+  def build_batch(self, column):
+    return build_fingerprints(column, self.lut, self.mapped, num_bins=self.num_bins)
+
+  def build_mask_batch(self, workload):
+    return self.build_batch(split_workload(workload)[0])
+
+  def spec(self):
+    # The canonical description (independent of how the partition was written down).
+    return {
+      'kind' : 'byte',
+      'num_bins' : self.num_bins,
+      'lut' : self.lut.tolist(),
+      'mapped' : self.mapped.tolist()
+    }
+
+class NGramFingerprinter:
+# The n-gram fingerprint: each (byte) n-gram sets the bit of its bin.
+# N-grams listed in the partition go to their bin, all others are hashed.
+  def __init__(self, n, partition=None, num_bins=None):
+    assert 1 <= n <= 4, 'Only n-grams of up to 4 bytes are supported!'
+    self.n = n
+    self.partition = partition
+    self.num_bins = num_bins if num_bins is not None else get_num_bins(partition)
+
+    # The explicit n-gram -> bin mapping.
+    self.ngram_mapping = {}
+    for bin_idx in (partition or {}):
+      for ngram in partition[bin_idx]:
+        ngram = ngram.encode('utf-8')
+        assert len(ngram) == n, f'N-gram {ngram} does not have {n} bytes!'
+        self.ngram_mapping[ngram_code(ngram)] = int(bin_idx)
+    self.codes = np.array(sorted(self.ngram_mapping), dtype=np.int64)
+    self.code_bins = np.array([self.ngram_mapping[code] for code in self.codes], dtype=np.int64)
+
+  def bin_of(self, code):
+    if code in self.ngram_mapping:
+      return self.ngram_mapping[code]
+    return int(hash_ngram_codes([code], self.num_bins)[0])
+
+  def build(self, text: str) -> int:
+    data = text.encode('utf-8')
+    fingerprint = 0
+    for pos in range(len(data) - self.n + 1):
+      fingerprint |= 1 << self.bin_of(ngram_code(data[pos:pos + self.n]))
+    return fingerprint
+
+  def build_mask(self, pattern: str) -> int:
+    # NOTE: Patterns shorter than `n` have no n-gram, hence cannot prune anything.
+    return self.build(split_like_pattern(pattern)[0])
+
+  def build_batch(self, column):
+    offsets, data = column_buffers(column)
+    data = data[offsets[0]:offsets[-1]].astype(np.int64)
+    starts = offsets[:-1] - offsets[0]
+    lengths = np.diff(offsets)
+
+    # The n-gram starting at each position (padded at the end of the buffer).
+    padded = np.concatenate([data, np.zeros(self.n - 1, dtype=np.int64)])
+    codes = np.zeros(len(data), dtype=np.int64)
+    for idx in range(self.n):
+      codes = (codes << 8) | padded[idx:idx + len(data)]
+
+    # Only n-grams lying within their string are valid.
+    ends = np.repeat(starts + lengths, lengths)
+    valid = np.arange(len(data)) + self.n <= ends
+
+    # Look up the listed n-grams, hash the rest.
+    bins = hash_ngram_codes(codes, self.num_bins).astype(np.int64)
+    if len(self.codes):
+      pos = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+      listed = self.codes[pos] == codes
+      bins[listed] = self.code_bins[pos[listed]]
+
+    # And OR the bits of each string together.
+    return reduce_bins(bins, starts, lengths, self.num_bins, valid=valid)
+
+  def build_mask_batch(self, workload):
+    return self.build_batch(split_workload(workload)[0])
+
+  def spec(self):
+    return {
+      'kind' : 'ngram',
+      'n' : self.n,
+      'num_bins' : self.num_bins,
+      'ngrams' : [[int(code), int(bin_idx)] for code, bin_idx in zip(self.codes, self.code_bins)]
+    }
+
+def reduce_events(rows, bins, num_rows, num_bins):
+# ORs the bits `bins` into their `rows`, the events being in any order.
+  order = np.argsort(rows, kind='stable')
+  counts = np.bincount(rows, minlength=num_rows)
+  starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+  return reduce_bins(bins[order], starts, counts, num_bins)
+
+DEFAULT_LENGTH_THRESHOLDS = [2, 3, 4, 6, 8, 12, 16, 24, 32]
+
+class CompositeFingerprinter:
+# A byte fingerprint extended by optional bit fields, in this order:
+# - multiplicity: a bit per bin that is hit at least twice,
+# - anchors: the bin of the first and of the last byte (one-hot each),
+# - length: a thermometer code of the byte length, i.e., bit `i` is set iff the length is >= `length_thresholds[i]`.
+# All fields are monotone under containment, so the subset test `(fp & mask) = mask` stays exact.
+  def __init__(self, partition, num_bins=None, multiplicity=False, anchors=False, length_thresholds=None):
+    self.base = ByteFingerprinter(partition, num_bins=num_bins)
+    self.partition = partition
+    self.multiplicity = multiplicity
+    self.anchors = anchors
+    self.length_thresholds = sorted(length_thresholds or [])
+
+    # The layout.
+    num_base_bins = self.base.num_bins
+    self.multiplicity_offset = num_base_bins
+    self.first_offset = self.multiplicity_offset + (num_base_bins if multiplicity else 0)
+    self.last_offset = self.first_offset + (num_base_bins if anchors else 0)
+    self.length_offset = self.last_offset + (num_base_bins if anchors else 0)
+    self.num_bins = self.length_offset + len(self.length_thresholds)
+
+  def build(self, text: str, prefix=True, suffix=True) -> int:
+    fingerprint = self.base.build(text)
+    data = text.encode('utf-8')
+    bins = [self.base.byte_mapping[byte] for byte in data]
+
+    if self.multiplicity:
+      for bin_idx in set(bin_idx for bin_idx in bins if bins.count(bin_idx) >= 2):
+        fingerprint |= 1 << (self.multiplicity_offset + bin_idx)
+    if self.anchors and bins:
+      if prefix:
+        fingerprint |= 1 << (self.first_offset + bins[0])
+      if suffix:
+        fingerprint |= 1 << (self.last_offset + bins[-1])
+    for idx, threshold in enumerate(self.length_thresholds):
+      if len(data) >= threshold:
+        fingerprint |= 1 << (self.length_offset + idx)
+    return fingerprint
+
+  def build_mask(self, pattern: str) -> int:
+    # NOTE: The anchor bits are only set for anchored patterns (`abc%` / `%abc`, see `split_like_pattern`).
+    pattern, prefix, suffix = split_like_pattern(pattern)
+    return self.build(pattern, prefix=prefix, suffix=suffix)
+
+  def build_batch(self, column, prefix=True, suffix=True):
+  # `prefix` (`suffix`): whether to set the bin of the first (last) byte, for all rows or per row.
+    offsets, data = column_buffers(column)
+    data = data[offsets[0]:offsets[-1]]
+    starts = offsets[:-1] - offsets[0]
+    lengths = np.diff(offsets)
+    num_rows = len(lengths)
+    base_bins = self.base.lut[data].astype(np.int64)
+    assert self.base.mapped[data].all(), 'Some bytes are not in your mapping!'
+
+    # The base bins.
+    rows = np.repeat(np.arange(num_rows), lengths)
+    event_rows, event_bins = [rows], [base_bins]
+
+    # Bins hit at least twice: all but the first hit of a (row, bin).
+    if self.multiplicity:
+      keys = rows * self.base.num_bins + base_bins
+      order = np.argsort(keys, kind='stable')
+      repeated = order[1:][keys[order][1:] == keys[order][:-1]]
+      event_rows.append(rows[repeated])
+      event_bins.append(self.multiplicity_offset + base_bins[repeated])
+
+    # The bins of the first and the last byte.
+    if self.anchors:
+      first_rows = np.flatnonzero((lengths > 0) & prefix)
+      last_rows = np.flatnonzero((lengths > 0) & suffix)
+      event_rows += [first_rows, last_rows]
+      event_bins += [
+        self.first_offset + base_bins[starts[first_rows]],
+        self.last_offset + base_bins[starts[last_rows] + lengths[last_rows] - 1]
+      ]
+
+    # The length thermometer.
+    for idx, threshold in enumerate(self.length_thresholds):
+      long_enough = np.flatnonzero(lengths >= threshold)
+      event_rows.append(long_enough)
+      event_bins.append(np.full(len(long_enough), self.length_offset + idx, dtype=np.int64))
+
+    return reduce_events(np.concatenate(event_rows), np.concatenate(event_bins), num_rows, self.num_bins)
+
+  def build_mask_batch(self, workload):
+    # Only anchored patterns (`abc%` / `%abc`) set the bin of their first (last) byte.
+    patterns, prefixes, suffixes = split_workload(workload)
+    masks = self.build_batch(patterns, prefix=prefixes, suffix=suffixes)
+
+    # Check that the anchored patterns got their anchor bits.
+    if self.anchors:
+      for mask, pattern, prefix, suffix in zip(fingerprints_to_ints(masks), patterns, prefixes, suffixes):
+        data = pattern.encode('utf-8')
+        assert not (data and prefix) or (mask >> (self.first_offset + self.base.byte_mapping[data[0]])) & 1, f'Missing first-byte bin of {pattern!r}!'
+        assert not (data and suffix) or (mask >> (self.last_offset + self.base.byte_mapping[data[-1]])) & 1, f'Missing last-byte bin of {pattern!r}!'
+    return masks
+
+  def spec(self):
+    return {
+      'kind' : 'composite',
+      'base' : self.base.spec(),
+      'multiplicity' : self.multiplicity,
+      'anchors' : self.anchors,
+      'length_thresholds' : self.length_thresholds
+    }
+
+def fingerprinter_digest(partition, num_bins=None):
+  # A content hash of the fingerprint function.
+  spec = fetch_fingerprinter(partition, num_bins=num_bins).spec()
+  return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+def split_like_pattern(like_expr):
+# Splits a workload entry into (pattern, anchored at the start, anchored at the end).
+# NOTE: Plain entries are substrings (`%pattern%`); `pattern%` is anchored at the start, `%pattern` at the end.
+  starts_open, ends_open = like_expr.startswith('%'), like_expr.endswith('%')
+  if not starts_open and not ends_open:
+    return like_expr, False, False
+  return like_expr.strip('%'), not starts_open, not ends_open
+
+def split_workload(workload):
+# The patterns of the workload entries and whether each is anchored at the start (end), see `split_like_pattern`.
+  splits = [split_like_pattern(like_expr) for like_expr in workload]
+  patterns = [pattern for pattern, _, _ in splits]
+  prefixes = np.array([prefix for _, prefix, _ in splits], dtype=bool)
+  suffixes = np.array([suffix for _, _, suffix in splits], dtype=bool)
+  return patterns, prefixes, suffixes
+
+def like_expression(like_expr):
+# The DuckDB LIKE-expression of a workload entry, e.g., `abc` -> `%abc%` and `abc%` -> `abc%`.
+  pattern, prefix, suffix = split_like_pattern(like_expr)
+  return ('' if prefix else '%') + pattern + ('' if suffix else '%')
+
+def matches_like_pattern(like_expr, word):
+# Whether `word` matches the workload entry (its pattern taken literally, as in `containment`).
+  pattern, prefix, suffix = split_like_pattern(like_expr)
+  if prefix and not word.startswith(pattern):
+    return False
+  if suffix and not word.endswith(pattern):
+    return False
+  return pattern in word
+
+def workload_containment(words, workload):
+# Returns the |workload| x |words| matrix telling whether a word matches a workload entry (see `split_like_pattern`).
+  patterns, prefixes, suffixes = split_workload(workload)
+  is_match = containment.containment_matrix(words, patterns)
+
+  # Anchored entries also need their pattern at the start (end) of the word.
+  for idx in np.flatnonzero(prefixes | suffixes).tolist():
+    is_match[idx] &= np.fromiter((matches_like_pattern(workload[idx], word) for word in words), dtype=bool, count=len(words))
+  return is_match
+
+def fetch_fingerprinter(partition, num_bins=None):
+  # Already a fingerprinter.
+  if hasattr(partition, 'build_batch'):
+    return partition
+
+  # A partition with a layout, e.g., `{'partition': {...}, 'layout': {'anchors': True}}`.
+  if partition is not None and 'layout' in partition:
+    return CompositeFingerprinter(partition['partition'], num_bins=num_bins, **partition['layout'])
+
+  # N-gram partitions list multi-character strings in their bins.
+  # NOTE: Single characters (also non-ASCII ones) stay bytes, mapped through `ord` (see `fetch_byte_mapping`).
+  if partition is not None:
+    ngrams = [elem for elems in partition.values() for elem in elems if isinstance(elem, str) and len(elem) > 1]
+    if ngrams:
+      ngram_lengths = set(len(ngram.encode('utf-8')) for ngram in ngrams)
+      assert len(ngram_lengths) == 1, 'All n-grams of a partition must have the same length!'
+      return NGramFingerprinter(ngram_lengths.pop(), partition=partition, num_bins=num_bins)
+
+  # Otherwise, a plain byte partition.
+  return ByteFingerprinter(partition, num_bins=num_bins)
+
+def fingerprint_macros_sql(partition, num_bins=None, name='nutella_fp', sql_type=None, temporary=True):
+# Returns the SQL macros computing the fingerprints in DuckDB alone: `{name}(text)`, `{name}_mask(pattern)` and `fp_may_contain(fp, pattern)`.
+# NOTE: Temporary macros also work on read-only databases; persist them with `temporary=False`.
+  fingerprinter = fetch_fingerprinter(partition, num_bins=num_bins)
+  assert isinstance(fingerprinter, ByteFingerprinter), 'Only byte partitions have SQL macros!'
+  assert fingerprinter.num_bins <= 128, 'Bitstring fingerprints have no SQL macros!'
+  sql_type = sql_type or fingerprint_sql_type(fingerprinter.num_bins)
+  create_macro = 'CREATE OR REPLACE TEMP MACRO' if temporary else 'CREATE OR REPLACE MACRO'
+
+  # Each 64-bin word is computed as a `UBIGINT`.
+  luts, ascii_words, byte_words = [], [], []
+  for word_idx in range(fingerprint_num_words(fingerprinter.num_bins)):
+    offset = 64 * word_idx
+    in_word = fingerprinter.mapped & (fingerprinter.lut.astype(np.int64) >= offset) & (fingerprinter.lut.astype(np.int64) < offset + 64)
+
+    # The bit of each byte (unmapped bytes set none, both in the texts and in the patterns).
+    luts.append(', '.join(str(1 << (int(bin_idx) - offset)) if is_set else '0' for bin_idx, is_set in zip(fingerprinter.lut, in_word)))
+
+    # ASCII texts: one `contains` per byte, which is much cheaper than regexes or list lambdas.
+    terms = []
+    for bin_idx in range(offset, min(offset + 64, fingerprinter.num_bins)):
+      bin_bytes = np.flatnonzero(in_word[:128] & (fingerprinter.lut[:128] == bin_idx)).tolist()
+      if bin_bytes:
+        terms.append(f"CASE WHEN {' OR '.join(f'contains(text, chr({byte}))' for byte in bin_bytes)} THEN {1 << (bin_idx - offset)}::UBIGINT ELSE 0::UBIGINT END")
+    ascii_words.append(' | '.join(f'({term})' for term in terms) or '0::UBIGINT')
+
+    # Other texts: their UTF-8 bytes are read off `hex`, two digits each.
+    byte_words.append(f"coalesce(list_aggregate(list_transform(range(0, strlen(hex(text)), 2), idx -> {name}_lut_{word_idx}()[('0x' || hex(text)[idx + 1 : idx + 2])::UTINYINT + 1]), 'bit_or'), 0::UBIGINT)")
+
+  def assemble(words):
+    # Two `UBIGINT`s make up a `UHUGEINT`.
+    if len(words) == 1:
+      return words[0]
+    return f'((({words[1]})::UHUGEINT << 64) | ({words[0]})::UHUGEINT)'
+
+  lut_macros = '\n'.join(f'    {create_macro} {name}_lut_{word_idx}() AS [{lut}]::UBIGINT[];' for word_idx, lut in enumerate(luts))
+  return f'''
+{lut_macros}
+    {create_macro} {name}_bytes(text) AS {assemble(byte_words)};
+    {create_macro} {name}(text) AS (
+      CASE WHEN text IS NULL THEN NULL
+           WHEN regexp_matches(text, '[^\\x00-\\x7f]') THEN {name}_bytes(text)
+           ELSE {assemble(ascii_words)}
+      END
+    )::{sql_type};
+    {create_macro} {name}_mask(pattern) AS {name}(CASE WHEN starts_with(pattern, '%') OR ends_with(pattern, '%') THEN trim(pattern, '%') ELSE pattern END);
+    {create_macro} fp_may_contain(fp, pattern) AS ((fp & {name}_mask(pattern)) = {name}_mask(pattern));
+  '''
+
+def fingerprints_to_ints(fingerprints):
+  # Wide fingerprints as Python integers.
+  fingerprints = np.asarray(fingerprints)
+  if fingerprints.ndim == 1:
+    return [int(fingerprint) for fingerprint in fingerprints]
+  return [sum(int(word) << (64 * idx) for idx, word in enumerate(row)) for row in fingerprints]
+
+def match_fingerprints(fingerprints, masks):
+# Returns the |masks| x |fingerprints| matrix telling whether a fingerprint covers a mask.
+  masks = masks[:, None]
+  ret = (fingerprints[None] & masks) == masks
+  return ret.all(axis=-1) if ret.ndim == 3 else ret
+
+def packed_field_bits(num_bins):
+  # Bits per packed fingerprint: the next power of two, so that the fields tile a 64-bit lane.
+  assert 1 <= num_bins <= 64, f'Cannot pack fingerprints with {num_bins} bins!'
+  return 1 << (num_bins - 1).bit_length()
+
+def _packed_layout(num_bins):
+  # The field width, the fields per lane and their shifts.
+  field_bits = packed_field_bits(num_bins)
+  fields_per_lane = 64 // field_bits
+  return field_bits, fields_per_lane, np.arange(fields_per_lane, dtype=np.uint64) * np.uint64(field_bits)
+
+def _broadcast_field(value, num_bins):
+  # Repeats `value` in every field of a lane.
+  field_bits, fields_per_lane, _ = _packed_layout(num_bins)
+  return np.uint64(sum(int(value) << (idx * field_bits) for idx in range(fields_per_lane)))
+
+def pack_fingerprints(fingerprints, num_bins):
+# Packs the fingerprints (along the last axis) into 64-bit lanes with `packed_field_bits(num_bins)` bits per row.
+  _, fields_per_lane, shifts = _packed_layout(num_bins)
+  fingerprints = np.asarray(fingerprints).astype(np.uint64)
+
+  # Pad to full lanes and OR the shifted fields together.
+  num_rows = fingerprints.shape[-1]
+  padded = np.zeros(fingerprints.shape[:-1] + (-(-num_rows // fields_per_lane) * fields_per_lane,), dtype=np.uint64)
+  padded[..., :num_rows] = fingerprints
+  return np.bitwise_or.reduce(padded.reshape(padded.shape[:-1] + (-1, fields_per_lane)) << shifts, axis=-1)
+
+def unpack_fingerprints(packed, num_bins, num_rows):
+  # Inverse of `pack_fingerprints`.
+  field_bits, _, shifts = _packed_layout(num_bins)
+  field_mask = np.uint64((1 << field_bits) - 1)
+  fingerprints = ((np.asarray(packed, dtype=np.uint64)[:, None] >> shifts) & field_mask).ravel()[:num_rows]
+  return fingerprints.astype(fingerprint_dtype(num_bins))
+
+def _match_packed_lanes(packed, mask, num_bins):
+  # Sets the lowest bit of each field whose fingerprint covers `mask` (SWAR).
+  field_bits, _, _ = _packed_layout(num_bins)
+
+  # The mask bits missing from each field.
+  missing = ~packed & _broadcast_field(mask, num_bins)
+
+  # OR-fold each field into its lowest bit; the shifts stay within the field.
+  shift = 1
+  while shift < field_bits:
+    missing |= missing >> np.uint64(shift)
+    shift <<= 1
+
+  # A row matches iff nothing is missing.
+  return ~missing & _broadcast_field(1, num_bins)
+
+def match_packed_fingerprints(packed, masks, num_bins, num_rows):
+# Same as `match_fingerprints`, but on packed fingerprints: tests all the rows of a lane at once.
+  field_bits, _, _ = _packed_layout(num_bins)
+  packed = np.asarray(packed, dtype=np.uint64)
+
+  ret = np.empty((len(masks), num_rows), dtype=bool)
+  for idx, mask in enumerate(np.asarray(masks).tolist()):
+    # Spread the lowest field bits to one byte per row.
+    lanes = _match_packed_lanes(packed, mask, num_bins)
+    ret[idx] = np.unpackbits(lanes.astype('<u8').view(np.uint8), bitorder='little')[::field_bits][:num_rows]
+  return ret
+
+def count_packed_matches(packed, masks, num_bins, num_rows, selected=None):
+# Counts, for each mask, the rows covering it; `selected` (|masks| x `num_rows`) restricts the rows counted.
+  packed = np.asarray(packed, dtype=np.uint64)
+
+  # The rows to count, packed the same way (one bit per field); the padding is never counted.
+  all_rows = pack_fingerprints(np.ones(num_rows, dtype=bool), num_bins)
+
+  # Popcount the matching lanes, without ever unpacking them.
+  ret = np.zeros(len(masks), dtype=np.int64)
+  for idx, mask in enumerate(np.asarray(masks).tolist()):
+    rows = all_rows if selected is None else pack_fingerprints(selected[idx], num_bins)
+    ret[idx] = compute_fingerprint_densities(_match_packed_lanes(packed, mask, num_bins) & rows).sum()
+  return ret
+
+def compute_fingerprint_densities(fingerprints):
+  fingerprints = np.asarray(fingerprints)
+  if not hasattr(np, 'bitwise_count'):
+    # Fallback: byte-wise popcount through a lookup table.
+    byte_popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+    as_bytes = np.ascontiguousarray(fingerprints).view(np.uint8).reshape(len(fingerprints), -1)
+    return byte_popcount[as_bytes].sum(axis=1).astype(np.int64)
+
+  # Wide fingerprints: sum over the words.
+  ret = np.bitwise_count(fingerprints)
+  return (ret.sum(axis=1) if ret.ndim > 1 else ret).astype(np.int64)
+
 def summarize(xs, simple=False):
   if simple:
     return {
@@ -77,55 +674,42 @@ def summarize(xs, simple=False):
   }
 
 def compute_data_stats(words, optimized_partition=None):
-  # Fetch the alphabet mapping.
-  byte_mapping = fetch_byte_mapping(None, optimized_partition)
+  # Fetch the fingerprinter.
+  fingerprinter = fetch_fingerprinter(optimized_partition)
 
-  # The array.
-  num_of_ones = []
+  # Build the word fingerprints.
+  word_fingerprints = fingerprinter.build_batch(words)
 
-  for word in words:
-    # Build the word fingerprint.
-    word_fingerprint = build_fingerprint(word, byte_mapping)
-
-    # Compute and
-    num_of_ones.append(compute_fingerprint_density(word_fingerprint))
-
-  # And return.
-  return num_of_ones
+  # And return the number of ones.
+  return compute_fingerprint_densities(word_fingerprints).tolist()
 
 def compute_workload_stats(workload, optimized_partition=None):
-  # Fetch the alphabet mapping.
-  byte_mapping = fetch_byte_mapping(None, optimized_partition)
+  # Fetch the fingerprinter.
+  fingerprinter = fetch_fingerprinter(optimized_partition)
 
-  # The array.
-  num_of_ones = []
+  # Build the query fingerprints.
+  query_fingerprints = fingerprinter.build_mask_batch(workload)
 
-  for query in workload:
-    # Build the word fingerprint.
-    query_fingerprint = build_fingerprint(query, byte_mapping)
-
-    # Compute and
-    num_of_ones.append(compute_fingerprint_density(query_fingerprint))
-
-  # And return.
-  return num_of_ones
+  # And return the number of ones.
+  return compute_fingerprint_densities(query_fingerprints).tolist()
 
 def run_with_duckdb(con, pattern, partition=None, num_bins=None):
-  # Fetch the alphabet mapping.
-  byte_mapping = fetch_byte_mapping(pattern, partition, num_bins=num_bins)
+  # Fetch the fingerprinter.
+  fingerprinter = fetch_fingerprinter(partition, num_bins=num_bins)
 
   # Build the fingerprint for the pattern.
-  pattern_fingerprint = build_fingerprint(pattern, byte_mapping)
+  pattern_fingerprint = fingerprinter.build_mask(pattern)
+  pattern_mask = fingerprint_sql_literal(pattern_fingerprint, fingerprinter.num_bins)
 
   # Query for false positives (bitmask match but not actual substring match).
   num_fps = con.execute(
-    '''
+    f'''
     SELECT COUNT(*) AS num_fps
     FROM words
-    WHERE ((word_fp & ?) = ?)
-      AND NOT (word LIKE '%' || ? || '%')
+    WHERE ((word_fp & {pattern_mask}) = {pattern_mask})
+      AND NOT (word LIKE ?)
     ''',
-    [pattern_fingerprint, pattern_fingerprint, pattern]
+    [like_expression(pattern)]
   ).fetchdf()['num_fps'][0]
 
   # Query for total negatives (all words that don’t contain the pattern).
@@ -133,9 +717,9 @@ def run_with_duckdb(con, pattern, partition=None, num_bins=None):
     '''
     SELECT COUNT(*) AS num_negs
     FROM words
-    WHERE NOT (word LIKE '%' || ? || '%')
+    WHERE NOT (word LIKE ?)
     ''',
-    [pattern]
+    [like_expression(pattern)]
   ).fetchdf()['num_negs'][0]
 
   return {
@@ -143,53 +727,164 @@ def run_with_duckdb(con, pattern, partition=None, num_bins=None):
     '#Ns': num_negs
   }
 
-def run(words, pattern, partition=None, num_bins=None):
-  # Fetch the alphabet mapping.
-  byte_mapping = fetch_byte_mapping(pattern, partition, num_bins=num_bins)
-
-  # Build the pattern fingerprint.
-  # verbose = False
-  # if pattern == ' ':
-  #   verbose = True
-  pattern_fingerprint = build_fingerprint(pattern, byte_mapping)#, verbose)
-
-  # if verbose:
-  #   print(f'pattern={pattern} => {pattern_fingerprint}')
-  #   print(byte_mapping)
-
-  # And run.
-  num_fps, num_tns, num_exact_matches, num_nutella_matches, num_negative_matches = 0, 0, 0, 0, 0
-
-  # TODO: Maybe take `set`?
-  for word in words:
-    # Build the word fingerprint.
-    word_fingerprint = build_fingerprint(word, byte_mapping)
-
-    # Check the exact match.
-    is_match = (pattern in word)
-    num_exact_matches += is_match
-
-    # Check the nutella match.
-    nutella_match = ((word_fingerprint & pattern_fingerprint) == pattern_fingerprint)
-    num_nutella_matches += nutella_match 
-
-    # The number of negative matches.
-    num_negative_matches += (not is_match)
-
-    # FPs.
-    num_fps += (nutella_match and (not is_match))
-
-    # TNs.
-    num_tns += ((not nutella_match) and (not is_match))
-
-  # print(f'pattern=..{pattern}.. >>>>> num_fps={num_fps}, num_tns={num_tns}')
+def run_workload_with_duckdb(con, workload, partition=None, num_bins=None):
+  # Fetch the fingerprinter.
+  fingerprinter = fetch_fingerprinter(partition, num_bins=num_bins)
+
+  # Register the workload as a (pattern, mask)-table.
+  # NOTE: Patterns without LIKE-wildcards can use the (much cheaper) `contains`.
+  mask_columns, mask_expr = fingerprint_columns(fingerprinter.build_mask_batch(workload), fingerprinter.num_bins, 'mask')
+  patterns_df = pd.DataFrame({
+    'pattern_idx' : np.arange(len(workload)),
+    'pattern' : workload,
+    'like_expr' : [like_expression(pattern) for pattern in workload],
+    'is_literal' : [('%' not in pattern) and ('_' not in pattern) for pattern in workload],
+    **mask_columns
+  })
+  con.register('patterns_df', patterns_df)
+
+  # Count the false positives and the negatives of all patterns in a single scan.
+  ret = con.execute(
+    f'''
+    SELECT pattern_idx,
+           COUNT(*) FILTER (WHERE nutella_match AND NOT is_match) AS num_fps,
+           COUNT(*) FILTER (WHERE NOT is_match) AS num_negs
+    FROM (
+      SELECT p.pattern_idx,
+             ((w.word_fp & p.mask) = p.mask) AS nutella_match,
+             CASE WHEN p.is_literal THEN contains(w.word, p.pattern)
+                  ELSE (w.word LIKE p.like_expr) END AS is_match
+      FROM (SELECT pattern_idx, pattern, like_expr, is_literal, {mask_expr} AS mask FROM patterns_df) p, words w
+    )
+    GROUP BY pattern_idx
+    '''
+  ).fetchdf()
+  con.unregister('patterns_df')
+
+  # Patterns without any group (empty `words`) have no FPs and no negatives.
+  counts = {row.pattern_idx: (row.num_fps, row.num_negs) for row in ret.itertuples()}
+  return [
+    {
+      '#FPs' : int(counts.get(idx, (0, 0))[0]),
+      '#Ns' : int(counts.get(idx, (0, 0))[1])
+    }
+    for idx in range(len(workload))
+  ]
 
-  # Return FPR.
-  assert num_negative_matches == (num_fps + num_tns)
-  return {
-    '#FPs' : num_fps,
-    '#Ns' : num_negative_matches
-  }
+def run(words, pattern, partition=None, num_bins=None):
+  return run_workload(words, [pattern], partition=partition, num_bins=num_bins)[0]
+
+def run_workload(words, workload, partition=None, num_bins=None, chunk_size=2**14, packed=False):
+  # Fetch the fingerprinter.
+  fingerprinter = fetch_fingerprinter(partition, num_bins=num_bins)
+
+  # Build the word fingerprints and the pattern masks (once).
+  word_fingerprints = fingerprinter.build_batch(words)
+  pattern_fingerprints = fingerprinter.build_mask_batch(workload)
+
+  # Exact containment of all patterns in one pass over the words.
+  is_match = workload_containment(words, workload)
+
+  if packed:
+    # Keep the fingerprints bit-packed and count the false positives lane by lane.
+    packed_fingerprints = pack_fingerprints(word_fingerprints, fingerprinter.num_bins)
+    num_fps = count_packed_matches(packed_fingerprints, pattern_fingerprints, fingerprinter.num_bins, len(words), selected=~is_match)
+  else:
+    # Test all masks against all word fingerprints (chunked to bound the memory).
+    num_fps = np.zeros(len(workload), dtype=np.int64)
+    for start in range(0, len(word_fingerprints), chunk_size):
+      end = start + chunk_size
+      nutella_match = match_fingerprints(word_fingerprints[start:end], pattern_fingerprints)
+      num_fps += np.count_nonzero(nutella_match & ~is_match[:, start:end], axis=1)
+  num_negs = np.count_nonzero(~is_match, axis=1)
+
+  return [
+    {
+      '#FPs' : int(num_fps[idx]),
+      '#Ns' : int(num_negs[idx])
+    }
+    for idx in range(len(workload))
+  ]
+
+def build_byte_sets(column):
+# Returns the set of bytes of each string as a 256-bit fingerprint (the identity partition).
+  offsets, data = column_buffers(column)
+  data = data[offsets[0]:offsets[-1]]
+  return reduce_bins(data, offsets[:-1] - offsets[0], np.diff(offsets), 256)
+
+def run_workload_multi(words, workload, partitions, num_bins=None, is_match=None, batch_size=8):
+# Evaluates K byte partitions at once; returns the K x |workload| matrices of #FPs and #Ns.
+  fingerprinters = [fetch_fingerprinter(partition, num_bins=num_bins) for partition in partitions]
+  assert all(isinstance(fingerprinter, ByteFingerprinter) for fingerprinter in fingerprinters), 'Only byte partitions can be stacked!'
+
+  # Identical partitions (e.g., consecutive incumbents) are evaluated once.
+  digests = [fingerprinter_digest(fingerprinter) for fingerprinter in fingerprinters]
+  distinct_idxs, distinct_of = [], {}
+  for idx, digest in enumerate(digests):
+    if digest not in distinct_of:
+      distinct_of[digest] = len(distinct_idxs)
+      distinct_idxs.append(idx)
+
+  # The fingerprints only depend on the byte set of a word: group the words by it.
+  distinct_sets, word_group = np.unique(build_byte_sets(words), axis=0, return_inverse=True)
+  word_group = word_group.ravel()
+  group_bits = np.unpackbits(distinct_sets.astype('<u8').view(np.uint8), axis=1, bitorder='little')
+  group_of_byte, group_bytes = np.nonzero(group_bits)
+  group_lengths = np.bincount(group_of_byte, minlength=len(distinct_sets))
+  group_starts = np.concatenate(([0], np.cumsum(group_lengths)[:-1]))
+
+  # The negatives of each pattern, per group.
+  if is_match is None:
+    is_match = workload_containment(words, workload)
+  group_negs = np.stack([np.bincount(word_group, weights=~is_match[idx], minlength=len(distinct_sets)) for idx in range(len(workload))]) if len(workload) else np.zeros((0, len(distinct_sets)))
+  num_negs = np.count_nonzero(~is_match, axis=1)
+
+  # The masks only depend on the patterns (the anchoring is not part of a byte fingerprint).
+  patterns = split_workload(workload)[0]
+
+  distinct_fps = np.zeros((len(distinct_idxs), len(workload)), dtype=np.int64)
+  for batch_start in range(0, len(distinct_idxs), batch_size):
+    batch = [fingerprinters[idx] for idx in distinct_idxs[batch_start:batch_start + batch_size]]
+    batch_num_bins = max(fingerprinter.num_bins for fingerprinter in batch)
+
+    # Make sure all bytes are covered by the partitions.
+    present = np.zeros(256, dtype=bool)
+    present[group_bytes] = True
+    for fingerprinter in batch:
+      assert not np.any(present & ~fingerprinter.mapped), f'Bytes: {np.flatnonzero(present & ~fingerprinter.mapped).tolist()} are not in your mapping!'
+
+    # Stack the LUTs (K x 256) and OR the bits of all K x |groups| segments in a single pass.
+    luts = np.stack([fingerprinter.lut for fingerprinter in batch])
+    stacked = reduce_bins(
+      luts[:, group_bytes].ravel(),
+      (group_starts[None] + len(group_bytes) * np.arange(len(batch))[:, None]).ravel(),
+      np.tile(group_lengths, len(batch)),
+      batch_num_bins
+    )
+    stacked = stacked.reshape((len(batch), len(distinct_sets)) + stacked.shape[1:])
+
+    # Count the false positives: the groups matching a mask, weighted by their negatives.
+    for offset, fingerprinter in enumerate(batch):
+      masks = build_fingerprints(patterns, fingerprinter.lut, fingerprinter.mapped, num_bins=batch_num_bins)
+      group_match = match_fingerprints(stacked[offset], masks)
+      distinct_fps[batch_start + offset] = np.rint((group_match * group_negs).sum(axis=1)).astype(np.int64)
+
+  # Scatter back to all K partitions.
+  num_fps = distinct_fps[[distinct_of[digest] for digest in digests]]
+  return num_fps, np.tile(num_negs, (len(partitions), 1))
+
+def run_mechanism_multi(words, workload, partitions, is_match=None, verbose=False):
+  # Run all partitions and patterns at once.
+  num_fps, num_negs = run_workload_multi(words, workload, partitions, is_match=is_match)
+
+  # Aggregate per partition.
+  ret = []
+  for idx in range(len(partitions)):
+    fpr = num_fps[idx].sum() / num_negs[idx].sum() if num_negs[idx].sum() > 0 else math.inf
+    if verbose:
+      print(f'# [|words|={len(words)} |workload|={len(workload)} partition={idx}] => #TNS={num_negs[idx].sum() - num_fps[idx].sum()}, #FPs={num_fps[idx].sum()}, #Ns={num_negs[idx].sum()}, FPR={fpr}')
+    ret.append(float(fpr))
+  return ret
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -236,15 +931,19 @@ def agg_info(info):
   fpr = num_fps / num_negs if num_negs > 0 else math.inf
   return num_fps, num_negs, fpr
 
-def run_mechanism_wrapper_with_duckdb(con, workload, partition, verbose=False):
+def run_mechanism_wrapper_with_duckdb(con, workload, partition, verbose=False, batched=True):
   # Run the experiment.
   info = []
-  for pattern in workload:
-    ret = run_with_duckdb(con, pattern, partition=partition)
-    info.append({
-      '#FPs': ret['#FPs'],
-      '#Ns': ret['#Ns']
-    })
+  if batched:
+    # One shared scan for all patterns.
+    info = run_workload_with_duckdb(con, workload, partition=partition)
+  else:
+    for pattern in workload:
+      ret = run_with_duckdb(con, pattern, partition=partition)
+      info.append({
+        '#FPs': ret['#FPs'],
+        '#Ns': ret['#Ns']
+      })
 
   # Aggregate.
   num_fps, num_negs, fpr = agg_info(info)
@@ -256,19 +955,8 @@ def run_mechanism_wrapper_with_duckdb(con, workload, partition, verbose=False):
   return fpr
 
 def run_mechanism(words, workload, partition, verbose=False):
-  # Take the max. length.
-  max_len = max(map(len, workload))
-
-  info = []
-  for pattern in workload:
-    # Run the optimized case.
-    ret = run(words, pattern, partition=partition)
-
-    # Append the FPR.
-    info.append({
-      '#FPs' : ret['#FPs'],
-      '#Ns' : ret['#Ns']
-    })
+  # Run all patterns at once.
+  info = run_workload(words, workload, partition=partition)
 
   # Aggregate.
   num_fps, num_negs, fpr = agg_info(info)
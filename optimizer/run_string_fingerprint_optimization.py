@@ -0,0 +1,153 @@
+"""
+Run one instance configuration:
+python run_string_fingerprint_optimization.py -config instance-configurations/name-name/config_name-name_0.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import string
+import time
+
+from logger_config import log_section, setup_logger
+from utils.optimizationDataProvider import OptimizationDataProvider
+from utils.results import build_results, run_name, write_results
+
+# solver backends: Gurobi (needs a license), HiGHS via scipy (linearized model only)
+# or the simulated annealing heuristic (see utils/localSearch.py)
+SOLVERS = ["gurobi", "highs", "local_search"]
+
+
+def get_alphabet(config):
+    """
+    Letters to partition, e.g., "string.printable" -> list(string.printable)
+    """
+    module, attribute = config["alphabet_option"].split(".")
+    assert module == "string", f"Unknown alphabet option {config['alphabet_option']}"
+    return list(getattr(string, attribute))
+
+
+def compute_data(config):
+    """
+    Read and select the words and patterns of the instance.
+    Returns the data provider and the selected words, patterns and
+    alphabet (before the presolve).
+    """
+    data_provider = OptimizationDataProvider(config, get_alphabet(config))
+    data_provider.parse_words_patterns()
+
+    getattr(data_provider, config["subset_pattern_selection_method"])(
+        config["subset_pattern_selection_method_seed"],
+        config["subset_pattern_nr_patterns"],
+        config["subset_pattern_nr_block"],
+    )
+    getattr(data_provider, config["subset_word_selection_method"])(
+        config["subset_word_selection_method_seed"],
+        config["subset_word_selection_method_nr_words"],
+        config["subset_word_nr_block"],
+    )
+    words, patterns = list(data_provider.words), list(data_provider.patterns)
+
+    data_provider.set_ngram_alphabet()
+    alphabet = list(data_provider.alphabet)
+
+    # the models compute the relation as a matrix (see containment_matrix)
+    if data_provider.bool_presolve:
+        data_provider.presolve()
+    data_provider.index_set_pattern_letters()
+    data_provider.index_set_word_letters()
+    return data_provider, words, patterns, alphabet
+
+
+def build_model(solver, data_provider, config):
+    """
+    Build the model for the solver backend.
+    Returns the solver object.
+    """
+    if solver == "gurobi":
+        # import here: gurobipy is not needed for the other backends
+        from utils.gurobiModelBuilder import GurobiModelBuilder
+        from utils.solveGurobimodel import SolveGurobiModel
+
+        gurobi_model_builder = GurobiModelBuilder(data_provider, config)
+        gurobi_model_builder.build_model()
+        return SolveGurobiModel(gurobi_model_builder, data_provider, config)
+
+    if solver == "local_search":
+        from utils.deltaFpr import DeltaFPR
+        from utils.localSearch import SolveLocalSearch
+
+        return SolveLocalSearch(DeltaFPR(data_provider), data_provider, config)
+
+    from utils.partitionModel import PartitionModel
+    from utils.solveHighsModel import SolveHighsModel
+
+    partition_model = PartitionModel(data_provider, config)
+    partition_model.build_model()
+    return SolveHighsModel(partition_model, data_provider, config)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config", required=True, help="instance configuration")
+    parser.add_argument(
+        "-solver",
+        choices=SOLVERS,
+        default=None,
+        help='solver backend (default: "solver" of the configuration or gurobi)',
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+    config["solver"] = args.solver or config.get("solver", "gurobi")
+    assert config["solver"] in SOLVERS, f"Unknown solver {config['solver']}"
+
+    name = run_name(args.config, config)
+    os.makedirs(config["store_dir_logfiles"], exist_ok=True)
+    setup_logger(os.path.join(config["store_dir_logfiles"], f"{name}.log"))
+    logger = logging.getLogger("run_string_fingerprint_optimization")
+    logger.info(f"Instance {name}, solver {config['solver']}")
+
+    start_time = time.perf_counter()
+
+    log_section("Compute data")
+    data_provider, words, patterns, alphabet = compute_data(config)
+    time_compute_data = time.perf_counter() - start_time
+    logger.info(
+        f"{len(data_provider.words)} words, {len(data_provider.patterns)} patterns, "
+        f"{len(data_provider.alphabet)} letters"
+    )
+
+    log_section("Build model")
+    building_start_time = time.perf_counter()
+    solver = build_model(config["solver"], data_provider, config)
+    time_building_model = time.perf_counter() - building_start_time
+
+    log_section("Solve model")
+    solving_start_time = time.perf_counter()
+    solver.solve()
+    solver.get_solution_and_optimization_status()
+    solver.get_bucket_partition()
+    solver.get_runtime()
+    time_solving_model = time.perf_counter() - solving_start_time
+    logger.info(f"Objective value: {solver.optimal_objective_value}")
+
+    timing = {
+        "time_compute_data": time_compute_data,
+        "time_building_model": time_building_model,
+        "gurobi_solution_time": solver.runtime,
+        "time_solving_model": time_solving_model,
+        "total_time": time.perf_counter() - start_time,
+    }
+    results = build_results(
+        config, words, patterns, alphabet, data_provider, solver, timing
+    )
+    write_results(
+        os.path.join(config["store_dir_results"], f"results_{name}.json"), results
+    )
+
+
+if __name__ == "__main__":
+    main()
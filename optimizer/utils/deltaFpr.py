@@ -0,0 +1,262 @@
+"""
+Incremental false positive counting for letter -> bin assignments:
+the change of the (weighted) number of false positives when moving a
+single letter to another bin, touching only the words and patterns
+containing that letter
+"""
+
+import numpy as np
+
+from utils.partitionModel import incidence_matrix
+
+
+class DeltaFPR:
+    """
+    Keeps the bins of the words and patterns (as bit masks, one row of
+    64-bit mask words per text for any number of bins) and, for each
+    pattern, the weight of the words it matches, i.e., whose bins are a
+    superset of the bins of the pattern; the match state of a (pattern,
+    word) combination is the subset test of their masks. A pattern not in
+    a word is a false positive iff they match; a pattern in a word always
+    matches. Hence, the number of false positives of a pattern is the
+    weight of its matching words minus the weight of the words containing it.
+
+    A move of a letter only changes the bins of the words and patterns
+    containing it. The changed words are grouped by their (old, new) bins,
+    the other words by their bins (mask table), so a move costs
+    O(affected words + affected patterns * masks + patterns * changed masks)
+    instead of O(words * patterns).
+    Counts are weighted with the presolve weights (one without presolve).
+    """
+
+    def __init__(self, data_provider, assignment=None):
+        self.number_bins = data_provider.number_bins
+        self.nr_letters = len(data_provider.alphabet)
+        nr_words = len(data_provider.words)
+        nr_patterns = len(data_provider.patterns)
+
+        # weights of the words and patterns (all one without presolve)
+        self._word_weights = np.asarray(
+            data_provider.word_weights or [1] * nr_words, dtype=float
+        )
+        self._pattern_weights = np.asarray(
+            data_provider.pattern_weights or [1] * nr_patterns, dtype=float
+        )
+        self._total_word_weight = self._word_weights.sum()
+
+        # [word_pos, letter_pos] = 1 if letter in word, analogously for the patterns
+        self._word_letters = incidence_matrix(
+            data_provider.list_word_positions, nr_words, self.nr_letters
+        )
+        self._pattern_letters = incidence_matrix(
+            data_provider.list_pattern_positions, nr_patterns, self.nr_letters
+        )
+        # columns: the words (patterns) containing a letter
+        self._letter_words = self._word_letters.tocsc()
+        self._letter_patterns = self._pattern_letters.tocsc()
+
+        # letters in no word and no pattern never change the false positives
+        self.movable_letters = np.flatnonzero(
+            np.diff(self._letter_words.indptr) + np.diff(self._letter_patterns.indptr)
+        )
+
+        # bits[bin_pos] = mask (row of 64-bit mask words) with only the bit of bin_pos
+        self._nr_mask_words = max(1, -(-self.number_bins // 64))
+        bins = np.arange(self.number_bins)
+        self._bits = np.zeros((self.number_bins, self._nr_mask_words), dtype=np.uint64)
+        self._bits[bins, bins // 64] = np.left_shift(
+            np.uint64(1), (bins % 64).astype(np.uint64)
+        )
+
+        # assignment[letter_pos] = bin_pos and the state it determines
+        self.assignment = None
+        # counts[pos, bin_pos] = number of letters of text pos in bin_pos
+        self._word_counts = self._pattern_counts = None
+        self._word_masks = self._pattern_masks = None
+        # distinct bins of the words and the weight of the words having them
+        self._table_masks = self._table_weights = None
+        # weight of the matching words of each pattern
+        self._match_weights = None
+        # last evaluated move (see delta)
+        self._move = None
+        self.reset(
+            np.zeros(self.nr_letters, dtype=np.int64)
+            if assignment is None
+            else assignment
+        )
+
+    def _masks(self, counts):
+        # masks[pos] = bins of text pos from counts[pos, bin_pos]
+        occupied = counts > 0
+        masks = np.zeros((len(counts), self._nr_mask_words), dtype=np.uint64)
+        for mask_word in range(self._nr_mask_words):
+            bins = slice(64 * mask_word, 64 * (mask_word + 1))
+            masks[:, mask_word] = np.bitwise_or.reduce(
+                np.where(occupied[:, bins], self._bits[bins, mask_word], np.uint64(0)),
+                axis=1,
+            )
+        return masks
+
+    def _match(self, pattern_masks, word_masks):
+        # [pattern, word] True if the bins of the pattern are a subset
+        matches = None
+        for mask_word in range(self._nr_mask_words):
+            patterns = pattern_masks[:, None, mask_word]
+            subset = (word_masks[None, :, mask_word] & patterns) == patterns
+            matches = subset if matches is None else matches & subset
+        return matches
+
+    def _group(self, masks, weights):
+        # distinct masks and their total weight, without zero weights
+        if self._nr_mask_words == 1:
+            unique_masks, inverse = np.unique(masks[:, 0], return_inverse=True)
+            unique_masks = unique_masks[:, None]
+        else:
+            unique_masks, inverse = np.unique(masks, axis=0, return_inverse=True)
+        unique_weights = np.bincount(
+            inverse.reshape(-1), weights=weights, minlength=len(unique_masks)
+        )
+        nonzero = unique_weights != 0
+        return unique_masks[nonzero], unique_weights[nonzero]
+
+    def reset(self, assignment):
+        """
+        Set the assignment: assignment[letter_pos] = bin_pos
+        (all letters in bin 0 if not given to the constructor)
+        """
+        self.assignment = np.array(assignment, dtype=np.int64)
+        one_hot = np.zeros((self.nr_letters, self.number_bins))
+        one_hot[np.arange(self.nr_letters), self.assignment] = 1
+        self._word_counts = np.asarray(self._word_letters @ one_hot).astype(np.int32)
+        self._pattern_counts = np.asarray(self._pattern_letters @ one_hot).astype(
+            np.int32
+        )
+        self._word_masks = self._masks(self._word_counts)
+        self._pattern_masks = self._masks(self._pattern_counts)
+        self._table_masks, self._table_weights = self._group(
+            self._word_masks, self._word_weights
+        )
+        self._match_weights = (
+            self._match(self._pattern_masks, self._table_masks) @ self._table_weights
+        )
+        self._move = None
+
+    @property
+    def objective(self):
+        """
+        Objective of the partition model: the (weighted) number of pattern
+        word combinations with pattern not in word that are no false positive
+        """
+        return float(
+            self._pattern_weights @ (self._total_word_weight - self._match_weights)
+        )
+
+    def _moved(self, counts, masks, incidence, letter, new_bin):
+        # the texts containing the letter whose bins change, and their new bins
+        positions = incidence.indices[
+            incidence.indptr[letter] : incidence.indptr[letter + 1]
+        ]
+        moved_counts = counts[positions]
+        moved_counts[:, self.assignment[letter]] -= 1
+        moved_counts[:, new_bin] += 1
+        moved_masks = self._masks(moved_counts)
+        changed = (moved_masks != masks[positions]).any(axis=1)
+        return positions, moved_counts, positions[changed], moved_masks[changed]
+
+    def delta(self, letter, new_bin):
+        """
+        Change of the (weighted) number of false positives when moving letter
+        to new_bin; the move is not applied (see apply).
+        """
+        if new_bin == self.assignment[letter]:
+            self._move = None
+            return 0.0
+
+        word_move = self._moved(
+            self._word_counts, self._word_masks, self._letter_words, letter, new_bin
+        )
+        pattern_move = self._moved(
+            self._pattern_counts,
+            self._pattern_masks,
+            self._letter_patterns,
+            letter,
+            new_bin,
+        )
+        _, _, words, new_word_masks = word_move
+        _, _, patterns, new_pattern_masks = pattern_move
+
+        # changed words grouped by (old mask, new mask): the match weights
+        # change by the weight of the new minus the old masks. A changed word
+        # contains the letter, so its old mask has the bit of the old bin
+        # and its new mask the one of the new bin; the other bits of both
+        # masks are those of the key (old without the old bin, new with it).
+        old_bit = self._bits[self.assignment[letter]]
+        new_bit = self._bits[new_bin]
+        keys, pair_weights = self._group(
+            (self._word_masks[words] & ~old_bit) | (new_word_masks & old_bit),
+            self._word_weights[words],
+        )
+        pair_masks = np.stack([keys | old_bit, keys | new_bit], axis=1)
+
+        def change(pattern_masks):
+            return (
+                self._match(pattern_masks, pair_masks[:, 1])
+                - self._match(pattern_masks, pair_masks[:, 0]).astype(float)
+            ) @ pair_weights
+
+        # all patterns for the changed words, the changed patterns against all words
+        match_weights = self._match_weights + change(self._pattern_masks)
+        match_weights[patterns] = self._match(
+            new_pattern_masks, self._table_masks
+        ) @ self._table_weights + change(new_pattern_masks)
+
+        self._move = (
+            letter,
+            new_bin,
+            word_move,
+            pattern_move,
+            pair_masks,
+            pair_weights,
+            match_weights,
+        )
+        return float(self._pattern_weights @ (match_weights - self._match_weights))
+
+    def apply(self):
+        """
+        Apply the move evaluated last by delta, in place
+        """
+        if self._move is None:
+            return
+        (
+            letter,
+            new_bin,
+            word_move,
+            pattern_move,
+            pair_masks,
+            pair_weights,
+            self._match_weights,
+        ) = self._move
+        word_positions, word_counts, words, new_word_masks = word_move
+        pattern_positions, pattern_counts, patterns, new_pattern_masks = pattern_move
+
+        self._word_counts[word_positions] = word_counts
+        self._word_masks[words] = new_word_masks
+        self._pattern_counts[pattern_positions] = pattern_counts
+        self._pattern_masks[patterns] = new_pattern_masks
+
+        # move the weight of the changed words in the mask table
+        self._table_masks, self._table_weights = self._group(
+            np.concatenate([self._table_masks, pair_masks[:, 0], pair_masks[:, 1]]),
+            np.concatenate([self._table_weights, -pair_weights, pair_weights]),
+        )
+
+        self.assignment[letter] = new_bin
+        self._move = None
+
+    def move(self, letter, new_bin):
+        """
+        Move letter to new_bin; returns the change of the false positives
+        """
+        delta = self.delta(letter, new_bin)
+        self.apply()
+        return delta
@@ -0,0 +1,183 @@
+"""
+Anytime local search for the bucket partition: simulated annealing over
+the letter -> bin assignments, restarted in parallel processes.
+Moves are evaluated incrementally (see utils/deltaFpr.py).
+An alternative to the MIP for large word sets or many bins.
+"""
+
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.results import STATUS_NAMES, bucket_partition
+
+# number of random moves whose mean objective change is the initial temperature
+CALIBRATION_MOVES = 100
+# final temperature relative to the initial one (geometric cooling over the time limit)
+FINAL_TEMPERATURE_RATIO = 1e-3
+
+
+def anneal(delta_fpr, seed, start_time, time_limit):
+    """
+    One simulated annealing run from a random assignment, for time_limit
+    seconds. Returns the improvements of the best assignment as
+    (time since start_time, assignment, objective value).
+    The objective is the one of the partition model, i.e., it increases
+    by the decrease of the false positives of a move.
+    """
+    run_start_time = time.time()
+    rng = np.random.default_rng(seed)
+    number_bins = delta_fpr.number_bins
+
+    delta_fpr.reset(rng.integers(0, number_bins, delta_fpr.nr_letters))
+    best_score = delta_fpr.objective
+    improvements = [
+        (time.time() - start_time, delta_fpr.assignment.tolist(), best_score)
+    ]
+    if number_bins < 2 or not len(delta_fpr.movable_letters):
+        return improvements
+
+    def random_move():
+        # a letter to another bin
+        letter = rng.choice(delta_fpr.movable_letters)
+        new_bin = rng.integers(0, number_bins - 1)
+        return letter, new_bin + (new_bin >= delta_fpr.assignment[letter])
+
+    # initial temperature: mean objective change of random moves
+    start_temperature = max(
+        np.mean(
+            [abs(delta_fpr.delta(*random_move())) for _ in range(CALIBRATION_MOVES)]
+        ),
+        1.0,
+    )
+
+    while True:
+        elapsed = time.time() - run_start_time
+        if elapsed >= time_limit:
+            break
+        temperature = start_temperature * FINAL_TEMPERATURE_RATIO ** (
+            elapsed / time_limit
+        )
+
+        letter, new_bin = random_move()
+        delta = -delta_fpr.delta(letter, new_bin)
+        if delta >= 0 or rng.random() < math.exp(delta / temperature):
+            delta_fpr.apply()
+            score = delta_fpr.objective
+            if score > best_score:
+                best_score = score
+                improvements.append(
+                    (time.time() - start_time, delta_fpr.assignment.tolist(), score)
+                )
+    return improvements
+
+
+class SolveLocalSearch:
+    def __init__(self, delta_fpr, data_provider, config):
+        # incremental objective of the assignments (DeltaFPR)
+        self._delta_fpr = delta_fpr
+        self._data_provider = data_provider  # containing all instances data
+        self._config = config
+        self._best_assignment = None
+        self._solve_time = None
+        self.sparse_sol = {}  # solution (x variables that are one)
+        self._feasible_point_exists = False
+        self.status_code = None  # numeric status (Gurobi's codes)
+        self.optimization_status = None  # optimization status string
+        self.dict_bucket_items = {}  # dictionary partitioning of alphabet into buckets
+        # list (time, solution, objective value) for all improvements over all restarts
+        self.intermediate_solutions = []
+        # no bounds for a heuristic
+        self.time_best_current_bound = []
+        # runtime of solution process
+        self.runtime = None
+        self.optimal_objective_value = None
+        self.final_gap = None
+
+    def _sparse_solution(self, assignment):
+        # the x variables of the MIP that are one
+        return {
+            f"x[{letter_pos},{bin_pos}]": 1.0
+            for letter_pos, bin_pos in enumerate(assignment)
+        }
+
+    def solve(self):
+        """
+        Run the restarts in parallel processes (one per thread); the time
+        limit is split among the restarts run one after the other.
+        """
+        logger = logging.getLogger("run_string_fingerprint_optimization")
+        parameter = self._config.get("local_search_parameter", {})
+        nr_processes = self._config["gurobi_parameter"]["threads"]
+        nr_restarts = parameter.get("restarts", nr_processes)
+        seed = parameter.get("seed", 0)
+        nr_processes = min(nr_processes, nr_restarts)
+        time_limit = self._config["gurobi_parameter"]["timelimit"] / math.ceil(
+            nr_restarts / nr_processes
+        )
+
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=nr_processes) as executor:
+            runs = list(
+                executor.map(
+                    anneal,
+                    [self._delta_fpr] * nr_restarts,
+                    range(seed, seed + nr_restarts),
+                    [start_time] * nr_restarts,
+                    [time_limit] * nr_restarts,
+                )
+            )
+        self._solve_time = time.time() - start_time
+
+        for restart, improvements in enumerate(runs):
+            logger.info(
+                f"Restart {restart}: objective value {improvements[-1][2]} "
+                f"({len(improvements)} improvements)"
+            )
+
+        # improvements of the best assignment over all restarts
+        best_score = -float("inf")
+        for time_found, assignment, score in sorted(
+            (improvement for improvements in runs for improvement in improvements),
+            key=lambda improvement: improvement[0],
+        ):
+            if score > best_score:
+                best_score = score
+                self._best_assignment = assignment
+                self.intermediate_solutions.append(
+                    (time_found, self._sparse_solution(assignment), score)
+                )
+        if not self._config["store_intermediate_solutions"]:
+            self.intermediate_solutions = []
+
+    def get_solution_and_optimization_status(self):
+        """
+        Store the best assignment in self.sparse_sol.
+        Format: {var_name: value}
+        """
+        self.status_code = 9  # the time limit ends the search
+        self.optimization_status = STATUS_NAMES[self.status_code]
+        logger = logging.getLogger("run_string_fingerprint_optimization")
+        logger.info(f"Solver status: {self.optimization_status}")
+
+        self._feasible_point_exists = True
+        self.sparse_sol = self._sparse_solution(self._best_assignment)
+        self._delta_fpr.reset(self._best_assignment)
+        self.optimal_objective_value = self._delta_fpr.objective
+
+    def get_bucket_partition(self):
+        """
+        Get from solution the bucket partition
+        """
+        x_values = np.zeros((self._delta_fpr.nr_letters, self._delta_fpr.number_bins))
+        x_values[np.arange(self._delta_fpr.nr_letters), self._best_assignment] = 1
+        self.dict_bucket_items = bucket_partition(x_values, self._data_provider)
+
+    def get_runtime(self):
+        """
+        Store runtime of solving process
+        """
+        self.runtime = self._solve_time
@@ -5,6 +5,9 @@ This class provides all data necessary to build the optimization problem
 import statistics
 import math
 import random
+from itertools import chain
+
+from utils.stringArena import StringArena
 
 
 class OptimizationDataProvider:
@@ -14,7 +17,8 @@ class OptimizationDataProvider:
         # text file containing line by line all patterns
         self._path_to_patterns = config["file_path_patterns"]
 
-        self.words = []  # list of words
+        # list of words; a StringArena of the whole file until a subset is taken
+        self.words = []
         self.patterns = []  # list of patterns
         # dictionary: key pattern value tuple of two lists:
         # first list words containg pattern,
@@ -24,6 +28,8 @@ class OptimizationDataProvider:
         self.number_bins = config["number_of_bins"]
         # list of letters to partition to the bins
         self.alphabet = alphabet
+        # 1 -> partition single letters, n > 1 -> partition n-grams (bins -> n-grams)
+        self.ngram_size = config.get("ngram_size", 1)
 
         # for each pattern, translate string into position of alphabet (pattern_pos, pattern, positions)
         self.list_pattern_positions = []
@@ -33,6 +39,16 @@ class OptimizationDataProvider:
         self.list_word_positions = []
         self.dict_word_positions = {}
 
+        # presolve_set_of_patterns_words: True -> reduce the instance (see presolve)
+        self.bool_presolve = config.get("presolve_set_of_patterns_words", False)
+        # weight of each word/pattern, i.e., how many words/patterns it stands for
+        self.word_weights = []
+        self.pattern_weights = []
+        # (word, pattern) combinations that are false positives under every partition
+        self.forced_false_positives = set()
+        # letters in no word and no pattern (put into the first bin afterwards)
+        self.unused_letters = []
+
     def _read_lines_to_list(self, filepath):
         lines = []
         with open(filepath, "r", encoding="utf-8") as file:
@@ -41,9 +57,38 @@ class OptimizationDataProvider:
         return lines
 
     def parse_words_patterns(self):
-        self.words = self._read_lines_to_list(self._path_to_words)
+        # the word files are large, but only a block of them is used
+        self.words = StringArena.from_file(self._path_to_words)
         self.patterns = self._read_lines_to_list(self._path_to_patterns)
 
+    def tokenize(self, text):
+        """
+        Split a string into the units that are partitioned to the bins:
+        its letters or, if ngram_size > 1, its n-grams.
+        "abc" -> ["a", "b", "c"] or ["ab", "bc"]
+        """
+        if self.ngram_size == 1:
+            return list(text)
+        return [
+            text[pos : pos + self.ngram_size]
+            for pos in range(len(text) - self.ngram_size + 1)
+        ]
+
+    def set_ngram_alphabet(self):
+        """
+        For n-gram partitions, the alphabet consists of all n-grams
+        occurring in the (selected) words and patterns.
+        """
+        if self.ngram_size == 1:
+            return
+        self.alphabet = sorted(
+            set(
+                ngram
+                for text in chain(self.words, self.patterns)
+                for ngram in self.tokenize(text)
+            )
+        )
+
     def determine_pattern_words_relation(self):
         """
         For each pattern and word, determine if pattern is part of the word.
@@ -54,6 +99,70 @@ class OptimizationDataProvider:
             for pattern in self.patterns
         }
 
+    def _group_by_letter_set(self, texts):
+        """
+        Group texts by their set of letters (n-grams).
+        Returns the list of (representative, number of texts) in order of
+        first occurrence.
+        """
+        groups = {}
+        for text in texts:
+            key = frozenset(self.tokenize(text))
+            if key in groups:
+                groups[key][1] += 1
+            else:
+                groups[key] = [text, 1]
+        return [tuple(group) for group in groups.values()]
+
+    def presolve(self):
+        """
+        Exact reduction of the instance (presolve_set_of_patterns_words).
+        The bins of a word only depend on its set of letters. A pattern
+        not in a word whose letters all are in the word is a false
+        positive under every partition, so its eta is always zero.
+        Hence, all other false positives only depend on the letter sets:
+        - words (patterns) with the same letter set are merged into one
+          word (pattern) weighted by their number
+        - (word, pattern) combinations that are always false positives
+          are dropped, as are words without any other combination
+        - letters in no word and no pattern are dropped from the alphabet
+        The objective value is the one of the full instance.
+        Call after selecting the subsets and before the index_set_* methods.
+        """
+        word_groups = self._group_by_letter_set(self.words)
+        pattern_groups = self._group_by_letter_set(self.patterns)
+        self.patterns = [pattern for pattern, _ in pattern_groups]
+        self.pattern_weights = [weight for _, weight in pattern_groups]
+
+        # keep the words with at least one avoidable false positive
+        pattern_letters = [set(self.tokenize(pattern)) for pattern in self.patterns]
+        self.words, self.word_weights = [], []
+        self.forced_false_positives = set()
+        for word, weight in word_groups:
+            word_letters = set(self.tokenize(word))
+            avoidable = False
+            for pattern, letters in zip(self.patterns, pattern_letters):
+                if pattern in word:
+                    continue
+                if letters <= word_letters:
+                    self.forced_false_positives.add((word, pattern))
+                else:
+                    avoidable = True
+            if avoidable:
+                self.words.append(word)
+                self.word_weights.append(weight)
+
+        # drop the letters that are not used
+        used_letters = set(
+            token
+            for text in chain(self.words, self.patterns)
+            for token in self.tokenize(text)
+        )
+        self.unused_letters = [
+            letter for letter in self.alphabet if letter not in used_letters
+        ]
+        self.alphabet = [letter for letter in self.alphabet if letter in used_letters]
+
     def index_set_pattern_letters(self):
         """
         For each pattern, translate the string into a list of
@@ -64,7 +173,7 @@ class OptimizationDataProvider:
         letter_to_pos = {letter: idx for idx, letter in enumerate(self.alphabet)}
 
         for pattern_pos, pattern in enumerate(self.patterns):
-            positions = [letter_to_pos[char] for char in pattern]
+            positions = [letter_to_pos[token] for token in self.tokenize(pattern)]
             self.list_pattern_positions.append((pattern_pos, pattern, positions))
             self.dict_pattern_positions[pattern] = positions
 
@@ -78,7 +187,7 @@ class OptimizationDataProvider:
         letter_to_pos = {letter: idx for idx, letter in enumerate(self.alphabet)}
 
         for word_pos, word in enumerate(self.words):
-            positions = [letter_to_pos[char] for char in word]
+            positions = [letter_to_pos[token] for token in self.tokenize(word)]
             self.list_word_positions.append((word_pos, word, positions))
             self.dict_word_positions[word] = positions
 
@@ -138,6 +247,13 @@ class OptimizationDataProvider:
         Raises:
         - IndexError: If the starting index is out of bounds.
         """
+        # Shuffle the positions only; just the words of the block are decoded
+        if isinstance(self.words, StringArena):
+            # If max_nr_words is too large, take all words
+            with self.words as words:
+                self.words = words.shuffled_block(seed, max_nr_word, nr_block).to_list()
+            return
+
         # Copy and shuffle words
         words_copy = self.words[:]
         random.Random(seed).shuffle(words_copy)
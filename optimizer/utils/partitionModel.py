@@ -0,0 +1,326 @@
+"""
+Solver independent description of the partition model: variables,
+linear constraints as sparse matrices and the objective
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def incidence_matrix(list_positions, nr_rows, nr_letters):
+    """
+    Sparse 0/1 matrix [pos, letter_pos] = 1 if letter in text pos from the
+    (pos, text, letter_positions) tuples, ignoring repeated letters.
+    """
+    rows = np.concatenate(
+        [np.full(len(positions), pos) for pos, _, positions in list_positions]
+        + [np.zeros(0, dtype=int)]
+    ).astype(int)
+    cols = np.concatenate(
+        [np.asarray(positions, dtype=int) for _, _, positions in list_positions]
+        + [np.zeros(0, dtype=int)]
+    )
+    matrix = sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(nr_rows, nr_letters)
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def containment_matrix(words, patterns):
+    """
+    Boolean matrix [word_pos, pattern_pos] = True if pattern in word,
+    one vectorized substring search over all words per pattern.
+    """
+    words = np.asarray(list(words), dtype=str)
+    matrix = np.zeros((len(words), len(patterns)), dtype=bool)
+    for pattern_pos, pattern in enumerate(patterns):
+        matrix[:, pattern_pos] = np.char.find(words, pattern) >= 0
+    return matrix
+
+
+class PartitionModel:
+    def __init__(self, data_provider, config):
+        # class contain all data for the optimization model
+        self._data_provider = data_provider
+        # bool_linearize: True -> we linearize binary products on our own else not
+        self.bool_linearize = config["bool_linearize"]
+
+        self.nr_patterns = len(self._data_provider.patterns)
+        self.nr_words = len(self._data_provider.words)
+        self.nr_letters = len(self._data_provider.alphabet)
+        self.number_bins = self._data_provider.number_bins
+
+        # objective weights of the words and patterns (all one without presolve)
+        self._word_weights = np.asarray(
+            self._data_provider.word_weights or [1] * self.nr_words, dtype=float
+        )
+        self._pattern_weights = np.asarray(
+            self._data_provider.pattern_weights or [1] * self.nr_patterns,
+            dtype=float,
+        )
+
+        # sparse letter incidence matrices: [pattern_pos, letter_pos] = 1 if letter in pattern
+        self._pattern_letters = incidence_matrix(
+            self._data_provider.list_pattern_positions,
+            self.nr_patterns,
+            self.nr_letters,
+        )
+        # analogously for the words
+        self._word_letters = incidence_matrix(
+            self._data_provider.list_word_positions, self.nr_words, self.nr_letters
+        )
+
+        # index sets as arrays
+
+        # [word_pos, pattern_pos] True if pattern is not in word
+        not_included = ~containment_matrix(
+            self._data_provider.words, self._data_provider.patterns
+        )
+        if self._data_provider.bool_presolve:
+            # without the combinations that are false positives under every
+            # partition (see presolve): all letters of the pattern are in the word
+            shared_letters = (self._word_letters @ self._pattern_letters.T).toarray()
+            pattern_sizes = np.asarray(self._pattern_letters.sum(axis=1)).reshape(-1)
+            not_included &= shared_letters != pattern_sizes[None, :]
+
+        # (word_pos, pattern_pos) for pattern word combinations for which pattern is not in word,
+        # as two aligned arrays: combination k is (self.pair_word_pos[k], self.pair_pattern_pos[k])
+        self.pair_word_pos, self.pair_pattern_pos = np.nonzero(not_included)
+        self.nr_pairs = len(self.pair_word_pos)
+
+        # variable blocks (name, shape, binary) in the order of the flattened model
+        self.variables = [
+            # x[letter_pos, bin_pos] = 1 iff letter is partitioned to bin
+            ("x", (self.nr_letters, self.number_bins), True),
+            # id_p[pattern_pos, bin_pos] = 1 iff a letter of the pattern is in bin
+            ("id_p", (self.nr_patterns, self.number_bins), True),
+            # analogously for the words
+            ("id_w", (self.nr_words, self.number_bins), True),
+            # eta[k] = 1 only if combination k is correctly classified (no false positive)
+            ("eta", (self.nr_pairs,), True),
+        ]
+        if self.bool_linearize:
+            # helper variables for linearizing
+            self.variables.append(
+                ("helper_lin", (self.nr_pairs, self.number_bins), False)
+            )
+        self._offsets = {}
+        offset = 0
+        for name, shape, _ in self.variables:
+            self._offsets[name] = offset
+            offset += int(np.prod(shape))
+        self.nr_variables = offset
+
+        # arrays of the flattened model (see build_model)
+        self.objective = None
+        self.constraint_matrix = None
+        self.constraint_lb = self.constraint_ub = None
+        self.integrality = None
+
+    def _selection_matrix(self, positions, nr_cols):
+        """
+        Sparse matrix selecting row positions[k] in row k.
+        """
+        return sp.csr_matrix(
+            (np.ones(len(positions)), (np.arange(len(positions)), positions)),
+            shape=(len(positions), nr_cols),
+        )
+
+    def _per_bin(self, matrix):
+        """
+        Apply matrix to each bin of a (rows x bins) matrix variable, i.e.,
+        the coefficients with respect to the flattened (row-major) variable.
+        """
+        return sp.kron(matrix, sp.identity(self.number_bins), format="csr")
+
+    def _bin_sum(self, nr_rows):
+        """
+        Sum over the bins of each row of a (rows x bins) matrix variable.
+        """
+        return sp.kron(
+            sp.identity(nr_rows), np.ones((1, self.number_bins)), format="csr"
+        )
+
+    def _letter_constraints(self, incidence, id_name, name):
+        """
+        id[pos, bin_pos] = 1 iff a letter of text pos is in bin_pos
+        """
+        nr_rows = incidence.shape[0]
+        rows, cols = incidence.nonzero()
+        return [
+            # x[letter_pos, bin_pos] <= id[pos, bin_pos] for each letter of text pos
+            (
+                f"{name}_PartOne",
+                [
+                    (self._per_bin(self._selection_matrix(cols, self.nr_letters)), "x"),
+                    (-self._per_bin(self._selection_matrix(rows, nr_rows)), id_name),
+                ],
+                "<",
+                0,
+            ),
+            # id[pos, bin_pos] <= sum of x[letter_pos, bin_pos] over the letters of text pos
+            (
+                f"{name}_PartTwo",
+                [
+                    (sp.identity(nr_rows * self.number_bins), id_name),
+                    (-self._per_bin(incidence), "x"),
+                ],
+                "<",
+                0,
+            ),
+        ]
+
+    def linear_constraints(self):
+        """
+        All linear constraints as (name, blocks, sense, rhs): the sum of
+        matrix @ flattened variable over the (matrix, variable name)
+        blocks is <= (sense "<") or == (sense "=") rhs.
+        Without linearization, the quadratic false positive constraints
+        are not included (see GurobiModelBuilder).
+        """
+        # each letter only in one bucket
+        constraints = [
+            ("letter_to_bin", [(self._bin_sum(self.nr_letters), "x")], "=", 1)
+        ]
+
+        # constraints encoding id for patterns, i.e.,
+        # which buckets are set to one for a given pattern
+        constraints += self._letter_constraints(
+            self._pattern_letters, "id_p", "id_pattern"
+        )
+
+        # analogously constraints encoding id for words, i.e.,
+        # which buckets are set to one for a given word
+        constraints += self._letter_constraints(self._word_letters, "id_w", "id_word")
+
+        # implement false positive constraints
+        if self.bool_linearize:
+            helper_identity = sp.identity(self.nr_pairs * self.number_bins)
+            constraints += [
+                # helper[k, bin_pos] <= 1 - id_w[word_pos of k, bin_pos]
+                (
+                    "helper_lin_cons_One",
+                    [
+                        (helper_identity, "helper_lin"),
+                        (
+                            self._per_bin(
+                                self._selection_matrix(
+                                    self.pair_word_pos, self.nr_words
+                                )
+                            ),
+                            "id_w",
+                        ),
+                    ],
+                    "<",
+                    1,
+                ),
+                # helper[k, bin_pos] <= id_p[pattern_pos of k, bin_pos]
+                (
+                    "helper_lin_cons_Two",
+                    [
+                        (helper_identity, "helper_lin"),
+                        (
+                            -self._per_bin(
+                                self._selection_matrix(
+                                    self.pair_pattern_pos, self.nr_patterns
+                                )
+                            ),
+                            "id_p",
+                        ),
+                    ],
+                    "<",
+                    0,
+                ),
+                # eta[k] <= sum of helper[k, bin_pos] over the bins
+                (
+                    "helper_lin_cons_Three",
+                    [
+                        (sp.identity(self.nr_pairs), "eta"),
+                        (-self._bin_sum(self.nr_pairs), "helper_lin"),
+                    ],
+                    "<",
+                    0,
+                ),
+            ]
+        return constraints
+
+    def objective_weights(self):
+        """
+        Weights of the eta variables: the number of (pattern, word)
+        combinations each stands for.
+        """
+        return (
+            self._word_weights[self.pair_word_pos]
+            * self._pattern_weights[self.pair_pattern_pos]
+        )
+
+    def build_model(self):
+        """
+        Flatten the model into arrays: maximize objective @ v subject to
+        constraint_lb <= constraint_matrix @ v <= constraint_ub and
+        0 <= v <= 1, v integral where integrality is one.
+        Only the linearized model can be flattened.
+        """
+        if not self.bool_linearize:
+            raise ValueError(
+                "Only the linearized model can be flattened, set bool_linearize"
+            )
+
+        matrices, lbs, ubs = [], [], []
+        for _, blocks, sense, rhs in self.linear_constraints():
+            nr_rows = blocks[0][0].shape[0]
+            coefficients = dict((name, matrix) for matrix, name in blocks)
+            matrices.append(
+                sp.hstack(
+                    [
+                        coefficients.get(
+                            name, sp.csr_matrix((nr_rows, int(np.prod(shape))))
+                        )
+                        for name, shape, _ in self.variables
+                    ],
+                    format="csr",
+                )
+            )
+            lbs.append(np.full(nr_rows, -np.inf if sense == "<" else float(rhs)))
+            ubs.append(np.full(nr_rows, float(rhs)))
+        self.constraint_matrix = sp.vstack(matrices, format="csr")
+        self.constraint_lb = np.concatenate(lbs)
+        self.constraint_ub = np.concatenate(ubs)
+
+        self.objective = np.zeros(self.nr_variables)
+        eta_offset = self._offsets["eta"]
+        self.objective[eta_offset : eta_offset + self.nr_pairs] = (
+            self.objective_weights()
+        )
+
+        self.integrality = np.concatenate(
+            [
+                np.full(int(np.prod(shape)), 1 if binary else 0)
+                for _, shape, binary in self.variables
+            ]
+        )
+
+    def variable_values(self, values, name):
+        """
+        Values of the variable block name from the values of the flattened model
+        """
+        shape = next(shape for block, shape, _ in self.variables if block == name)
+        offset = self._offsets[name]
+        return np.asarray(values[offset : offset + int(np.prod(shape))]).reshape(shape)
+
+    def sparse_solution(self, values):
+        """
+        Solution without variables that are zero.
+        Format: {var_name: value}, named as by Gurobi, e.g., x[3,1]
+        """
+        solution = {}
+        for name, shape, _ in self.variables:
+            block = self.variable_values(values, name).reshape(-1)
+            for flat_pos in np.flatnonzero(np.abs(block) > 1e-6).tolist():
+                index = np.unravel_index(flat_pos, shape)
+                solution[f"{name}[{','.join(map(str, index))}]"] = float(
+                    block[flat_pos]
+                )
+        return solution
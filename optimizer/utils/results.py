@@ -0,0 +1,116 @@
+"""
+Results JSON of an optimization run, the same for all solver backends
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+# numeric status (Gurobi's codes, also used for the other backends) -> status string
+STATUS_NAMES = {
+    1: "LOADED",
+    2: "OPTIMAL",
+    3: "INFEASIBLE",
+    4: "INF_OR_UNBD",
+    5: "UNBOUNDED",
+    6: "CUTOFF",
+    7: "ITERATION_LIMIT",
+    8: "NODE_LIMIT",
+    9: "TIME_LIMIT",
+    10: "SOLUTION_LIMIT",
+    11: "INTERRUPTED",
+    12: "NUMERIC",
+    13: "SUBOPTIMAL",
+    14: "INPROGRESS",
+    15: "USER_OBJ_LIMIT",
+    16: "WORK_LIMIT",
+    17: "MEM_LIMIT",
+}
+
+# variable names as written by the solvers, e.g., x[3,1] or eta[7]
+VARIABLE_NAME = re.compile(r"^(\w+)\[([\d,]+)\]$")
+
+
+def bucket_partition(x_values, data_provider):
+    """
+    Bucket partition {bucket: letters} from the (letters x bins) values of x
+    """
+    dict_bucket_items = {bucket: [] for bucket in range(0, data_provider.number_bins)}
+
+    # (letter_pos, bucket) of the x variables set to one
+    for letter_pos, bucket in np.argwhere(np.asarray(x_values) > 0.5).tolist():
+        dict_bucket_items[bucket].append(data_provider.alphabet[letter_pos])
+
+    # letters dropped by the presolve can go to any bucket
+    dict_bucket_items[0].extend(data_provider.unused_letters)
+    return dict_bucket_items
+
+
+def bucket_partition_from_sparse_solution(sparse_solution, data_provider):
+    """
+    Bucket partition from a sparse solution {var_name: value}
+    """
+    x_values = np.zeros((len(data_provider.alphabet), data_provider.number_bins))
+    for var_name, value in sparse_solution.items():
+        match = VARIABLE_NAME.match(var_name)
+        if match and match.group(1) == "x":
+            letter_pos, bucket = map(int, match.group(2).split(","))
+            x_values[letter_pos, bucket] = value
+    return bucket_partition(x_values, data_provider)
+
+
+def run_name(config_path, config):
+    """
+    Name of a run, e.g.,
+    config_title-title_0-words-title-title-block-0-title-title-queries
+    """
+    config_name = os.path.splitext(os.path.basename(config_path))[0]
+    words_name = os.path.splitext(config["file_path_words"].replace("data/", "", 1))[
+        0
+    ].replace("/", "-")
+    patterns_name = os.path.splitext(os.path.basename(config["file_path_patterns"]))[0]
+    return f"{config_name}-{words_name}-{patterns_name}"
+
+
+def build_results(config, words, patterns, alphabet, data_provider, solver, timing):
+    """
+    Results dictionary of a solved instance.
+    solver is a SolveGurobiModel, SolveHighsModel or SolveLocalSearch; the keys keep
+    their gurobi_ prefix for all backends (the backend is stored in
+    the configuration under "solver").
+    """
+    return {
+        "configuration": config,
+        "words_in_optimization": list(words),
+        "patterns_in_optimization": list(patterns),
+        "alphabet": (
+            "".join(alphabet)
+            if all(len(letter) == 1 for letter in alphabet)
+            else list(alphabet)
+        ),
+        "gurobi_numeric_status": solver.status_code,
+        "gurobi_status": solver.optimization_status,
+        "intermediate_solutions_time_vars": solver.intermediate_solutions,
+        "gurobi_solution": solver.sparse_sol,
+        "partition": solver.dict_bucket_items,
+        "optimal_objective_value": solver.optimal_objective_value,
+        "final_optimality_gap": solver.final_gap,
+        "time_point_best_current_bound": solver.time_best_current_bound,
+        "intermediate_solutions_time_partition": [
+            (
+                time_found,
+                bucket_partition_from_sparse_solution(sparse_solution, data_provider),
+                obj_val,
+            )
+            for time_found, sparse_solution, obj_val in solver.intermediate_solutions
+        ],
+        "timing": timing,
+    }
+
+
+def write_results(filepath, results):
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    with open(filepath, "w") as f:
+        json.dump(results, f, indent=4)
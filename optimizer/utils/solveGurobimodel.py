@@ -4,6 +4,8 @@ import io
 from contextlib import redirect_stdout
 import logging
 
+from utils.results import STATUS_NAMES, bucket_partition
+
 
 class SolveGurobiModel:
     def __init__(self, gurobi_model_builder, data_provider, config):
@@ -98,21 +100,9 @@ class SolveGurobiModel:
         if not self._feasible_point_exists:
             return
 
-        # initialize buckets
-        self.dict_bucket_items = {
-            bucket: [] for bucket in range(0, self._data_provider.number_bins)
-        }
-
-        x_solution = {
-            index_tuple: var.X
-            for index_tuple, var in self._gurobi_model_builder.x_vars.items()
-            if abs(var.X) > 1e-6
-        }
-
-        for letter_pos, bucket in x_solution.keys():
-            self.dict_bucket_items[bucket].append(
-                self._data_provider.alphabet[letter_pos]
-            )
+        self.dict_bucket_items = bucket_partition(
+            self._gurobi_model_builder.x_vars.X, self._data_provider
+        )
 
     def get_runtime(self):
         """
@@ -129,26 +119,7 @@ class SolveGurobiModel:
         map numeric status code to status code string such as optimal
         return string
         """
-        gurobi_status_code_map = {
-            1: "LOADED",
-            2: "OPTIMAL",
-            3: "INFEASIBLE",
-            4: "INF_OR_UNBD",
-            5: "UNBOUNDED",
-            6: "CUTOFF",
-            7: "ITERATION_LIMIT",
-            8: "NODE_LIMIT",
-            9: "TIME_LIMIT",
-            10: "SOLUTION_LIMIT",
-            11: "INTERRUPTED",
-            12: "NUMERIC",
-            13: "SUBOPTIMAL",
-            14: "INPROGRESS",
-            15: "USER_OBJ_LIMIT",
-            16: "WORK_LIMIT",
-            17: "MEM_LIMIT",
-        }
-        return gurobi_status_code_map[self.status_code]
+        return STATUS_NAMES[self.status_code]
 
     def my_callback(self, model, where):
         if where == gp.GRB.Callback.MIP:
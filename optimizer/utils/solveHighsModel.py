@@ -0,0 +1,125 @@
+"""
+Solving the (linearized) partition model with HiGHS via scipy.optimize.milp,
+e.g., on machines without a Gurobi license
+"""
+
+import logging
+import time
+
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from utils.results import STATUS_NAMES, bucket_partition
+
+# scipy.optimize.milp status -> numeric status (Gurobi's codes, see STATUS_NAMES)
+MILP_STATUS_CODES = {
+    0: 2,  # optimal
+    1: 9,  # iteration or time limit
+    2: 3,  # infeasible
+    3: 5,  # unbounded
+    4: 11,  # other, e.g., interrupted
+}
+
+
+class SolveHighsModel:
+    def __init__(self, partition_model, data_provider, config):
+        # flattened model, see PartitionModel.build_model
+        self._partition_model = partition_model
+        self._data_provider = data_provider  # containing all instances data
+        self._config = config
+        self._result = None
+        self._solve_time = None
+        self.sparse_sol = {}  # solution without variables that are zero
+        self._feasible_point_exists = False
+        self.status_code = None  # numeric status (Gurobi's codes)
+        self.optimization_status = None  # optimization status string
+        self.dict_bucket_items = {}  # dictionary partitioning of alphabet into buckets
+        # list (time, solution) for all solutions found in solution process;
+        # milp only reports the final one
+        self.intermediate_solutions = []
+        # tuples time_point, best_current_bound
+        self.time_best_current_bound = []
+        # runtime of solution process
+        self.runtime = None
+        self.optimal_objective_value = None
+        self.final_gap = None
+
+    def solve(self):
+        """
+        Solve the model
+        """
+        logger = logging.getLogger("run_string_fingerprint_optimization")
+        # threads: HiGHS solves the MIP (branch and bound) on a single thread
+        logger.info(
+            "HiGHS: ignoring threads=%s, the MIP is solved on a single thread",
+            self._config["gurobi_parameter"]["threads"],
+        )
+
+        model = self._partition_model
+        start_time = time.perf_counter()
+        # milp minimizes
+        self._result = milp(
+            -model.objective,
+            integrality=model.integrality,
+            bounds=Bounds(0, 1),
+            constraints=LinearConstraint(
+                model.constraint_matrix, model.constraint_lb, model.constraint_ub
+            ),
+            options={
+                "disp": False,
+                "time_limit": self._config["gurobi_parameter"]["timelimit"],
+            },
+        )
+        self._solve_time = time.perf_counter() - start_time
+
+    def get_solution_and_optimization_status(self):
+        """
+        Store HiGHS solution in self.sparse_sol.
+        Only stores variables with non-zero value.
+        Format: {var_name: value}
+        """
+        self.sparse_sol = {}
+        self.optimal_objective_value = None
+        self.status_code = MILP_STATUS_CODES[self._result.status]
+        self.optimization_status = STATUS_NAMES[self.status_code]
+
+        # get logger
+        logger = logging.getLogger("run_string_fingerprint_optimization")
+        logger.info(f"Solver status: {self.optimization_status}")
+
+        if self._result.x is None:
+            logger.info(
+                f"❌ No feasible point available. HiGHS: {self._result.message}"
+            )
+            return
+
+        self._feasible_point_exists = True
+        self.sparse_sol = self._partition_model.sparse_solution(self._result.x)
+        self.optimal_objective_value = -self._result.fun
+        self.final_gap = getattr(self._result, "mip_gap", None)
+
+        dual_bound = getattr(self._result, "mip_dual_bound", None)
+        if dual_bound is not None:
+            self.time_best_current_bound.append((self._solve_time, -dual_bound))
+        if self._config["store_intermediate_solutions"]:
+            self.intermediate_solutions.append(
+                (self._solve_time, self.sparse_sol, self.optimal_objective_value)
+            )
+
+    def get_bucket_partition(self):
+        """
+        Get from solution the bucket partition
+        """
+        # skip if we have no feasible point
+        if not self._feasible_point_exists:
+            return
+
+        self.dict_bucket_items = bucket_partition(
+            self._partition_model.variable_values(self._result.x, "x"),
+            self._data_provider,
+        )
+
+    def get_runtime(self):
+        """
+        Store runtime of solving process
+        """
+        self.runtime = self._solve_time
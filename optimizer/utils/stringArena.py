@@ -0,0 +1,153 @@
+"""
+Compact storage of the lines of a text file: the file is memory-mapped
+and only the line boundaries are kept, so no string is created per line.
+Same interface as arena.StringArena of the evaluation code.
+"""
+
+import mmap
+import random
+
+import numpy as np
+
+
+class StringArena:
+    def __init__(self, data, starts, ends, file_map=None):
+        # uint8 buffer holding the strings (a view of file_map, if mapped)
+        self.data = data
+        # string i is data[starts[i] : ends[i]]
+        self.starts = starts
+        self.ends = ends
+        # the memory map owned by this arena (closed by close)
+        self._file_map = file_map
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        Memory-map the (UTF-8) file and index its lines.
+        Lines are split on newlines only, as _read_lines_to_list does.
+        """
+        with open(filepath, "rb") as file:
+            try:
+                file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                return cls.from_strings([])
+
+        # universal newlines ("\r\n", "\r") need the text mode
+        if file_map.find(b"\r") != -1:
+            file_map.close()
+            with open(filepath, "r", encoding="utf-8") as file:
+                return cls.from_strings([line.strip("\n") for line in file])
+
+        data = np.frombuffer(file_map, dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord("\n"))
+        # the last line need not end with a newline
+        ends = newlines if data[-1] == ord("\n") else np.append(newlines, len(data))
+        starts = np.concatenate([[0], newlines + 1])[: len(ends)]
+        return cls(data, starts, ends, file_map=file_map)
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        Pack a list of strings (without newlines) into an arena.
+        """
+        encoded = [string.encode("utf-8") for string in strings]
+        ends = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+        starts = ends - [len(value) for value in encoded]
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), starts, ends)
+
+    def close(self):
+        """
+        Release the memory map (if any); the arena is unusable afterwards.
+        """
+        self.data = self.starts = self.ends = None
+        if self._file_map is not None:
+            try:
+                self._file_map.close()
+            except BufferError:
+                # still viewed (e.g., by a slice); unmapped with the views
+                pass
+            self._file_map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, idx):
+        # slices are views on the same buffer
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return self.take(range(start, stop, step))
+            return StringArena(
+                self.data, self.starts[start:stop], self.ends[start:stop]
+            )
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("StringArena index out of range")
+        return self.data[self.starts[idx] : self.ends[idx]].tobytes().decode("utf-8")
+
+    def iter_bytes(self):
+        """
+        Yield the (UTF-8) bytes of the strings, without decoding them
+        """
+        data = self.data
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield data[start:end].tobytes()
+
+    def __iter__(self):
+        for value in self.iter_bytes():
+            yield value.decode("utf-8")
+
+    def to_list(self):
+        return list(self)
+
+    def take(self, indices):
+        """
+        Return a (compact) arena of the strings at indices, independent
+        of the memory map
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        starts = self.starts[indices]
+        lengths = self.ends[indices] - starts
+
+        ends = np.cumsum(lengths, dtype=np.int64)
+        # gather the bytes of all strings at once
+        positions = np.repeat(starts - (ends - lengths), lengths) + np.arange(
+            ends[-1] if len(ends) else 0
+        )
+        return StringArena(self.data[positions], ends - lengths, ends)
+
+    def shuffled_block(self, seed, block_size, nr_block):
+        """
+        Shuffle the lines with a fixed seed and return block nr_block.
+        Shuffling the positions permutes exactly as shuffling a list of
+        the lines, so the blocks equal the ones of the list-based
+        selection; only the lines of the block are copied.
+
+        Returns:
+        - Arena of the lines of the block, or the arena itself if
+          block_size covers all lines.
+
+        Raises:
+        - IndexError: If the starting index is out of bounds.
+        """
+        if block_size >= len(self):
+            return self
+
+        start_index = nr_block * block_size
+        if start_index >= len(self):
+            raise IndexError(
+                f"Block start index {start_index} is out of bounds for {len(self)} lines."
+            )
+
+        order = list(range(len(self)))
+        random.Random(seed).shuffle(order)
+        return self.take(order[start_index : start_index + block_size])
@@ -0,0 +1,41 @@
+import time
+import utils
+import common
+import nutella
+
+TABLE_COLUMNS = [('title', 'title'), ('cast_info', 'note')]
+NUMBER_OF_BINS = [8, 32, 64]
+UDF_TYPES = ['native', 'arrow', 'macro']
+
+def run(tn, cn):
+  # Load the IMDb database.
+  con = utils.open_duckdb('./dbs/imdb.duckdb', read_only=True, num_threads=1)
+
+  ret = []
+  for num_bins in NUMBER_OF_BINS:
+    # Take the naive partition.
+    partition = nutella.revert_byte_mapping(nutella.fetch_byte_mapping(None, None, num_bins=num_bins))
+
+    entry = { 'number_of_bins' : num_bins }
+    for udf_type in UDF_TYPES:
+      # Time the fingerprint build of the whole column.
+      start_time = time.time()
+      common.load_table(con, tn, cn, partition, udf_type=udf_type)
+      entry[udf_type] = time.time() - start_time
+
+      # Drop the table and the UDF (or the macro) for the next run.
+      con.execute('DROP TABLE words;')
+      if udf_type == 'macro':
+        con.execute('DROP MACRO nutella_fp;')
+      else:
+        con.remove_function('nutella_fp')
+    ret.append(entry)
+
+  con.close()
+  return ret
+
+if __name__ == '__main__':
+  for tn, cn in TABLE_COLUMNS:
+    print(f'\n==== {tn}.{cn} ====')
+    for entry in run(tn, cn):
+      print(f'{entry} => speedup: arrow={entry["native"] / entry["arrow"]:.2f}x, macro={entry["native"] / entry["macro"]:.2f}x')
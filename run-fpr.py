@@ -1,14 +1,23 @@
 import os
+import atexit
 import utils 
 import common
+import fpindex
+import fprcache
+import arena
 import config_analyzer
 
 TABLE_NAME = 'title'
 COLUMN_NAME = 'title'
 BLOCK = 0
+DB_PATH = './dbs/imdb.duckdb'
 RESULTS_FOLDER = f'./results/{TABLE_NAME}-{COLUMN_NAME}'
 CACHE_FOLDER = f'./cache/{TABLE_NAME}-{COLUMN_NAME}'
 FORCE_RERUN = True
+
+# The FPRs are cached by (partition, word set, query set, evaluator), so reruns only evaluate what changed.
+FPR_CACHE_FOLDER = fprcache.CACHE_DIR
+FPR_CACHE_MAX_BYTES = fprcache.MAX_CACHE_BYTES
 TIMELIMIT = None
 VERBOSE = True
 
@@ -16,6 +25,17 @@ VERBOSE = True
 GENERALIZATION = True
 TABLE_GENERALIZATION = True
 
+# The fingerprint indexes of the table generalization (`None` recomputes the fingerprints).
+INDEX_DIR = fpindex.INDEX_DIR
+
+# Stream the table column batch by batch (bounded memory): always (`True`), only above `STREAM_TABLE_MIN_ROWS` rows (`None`),
+# or never (`False`; the whole column is then staged in shared memory).
+STREAM_TABLE = True
+STREAM_TABLE_MIN_ROWS = 2**20
+
+# Score all (byte) partitions of a trajectory in one pass, instead of one process per partition.
+MULTI_PARTITION = True
+
 # CHOSEN_TIMESTAMPS = [0.1, 0.5, 1.0, 5.0, 10.0, 50.0, 100.0, 500.0, 1000.0]
 # CHOOSE = False
 
@@ -37,14 +57,95 @@ configs = utils.filter_configs(
 )
 
 from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing.util
 import nutella
 
-def compute_naive(config_path, generalization=False, table_generalization=False, summary_type='avg'):
-  # Init the analyzer.
-  analyzer = config_analyzer.ConfigAnalyzer(TABLE_NAME, COLUMN_NAME, config_path)
+# The staged data and the evaluation session of this (worker) process.
+dataset, session = None, None
 
-  # Get the data.
+def stream_table():
+  # Whether the table generalization streams the table column (see `STREAM_TABLE`).
+  if STREAM_TABLE is not None:
+    return STREAM_TABLE
+  return common.count_imdb_column(TABLE_NAME, COLUMN_NAME, db_path=DB_PATH) > STREAM_TABLE_MIN_ROWS
+
+def stage_data(config_path, table_generalization=False):
+  # Stage the word sets, the queries (and the table column) of the config once in shared memory.
+  analyzer = config_analyzer.ConfigAnalyzer(TABLE_NAME, COLUMN_NAME, config_path)
   train_words, train_queries, all_words, test_queries = analyzer.get_data()
+  columns = {
+    'train' : train_words,
+    'all' : all_words,
+    'train-queries' : train_queries,
+    'test-queries' : test_queries
+  }
+
+  # The keys of the word sets in the FPR cache.
+  keys = {
+    'train' : fprcache.words_digest(train_words),
+    'all' : fprcache.words_digest(all_words)
+  }
+  if table_generalization:
+    if not stream_table():
+      columns['table'] = common.fetch_imdb_column_arrow(TABLE_NAME, COLUMN_NAME, db_path=DB_PATH)
+    keys['table'] = fprcache.table_digest(DB_PATH, TABLE_NAME, COLUMN_NAME)
+  return arena.SharedDataset.create(columns), keys
+
+def init_session(handles, keys):
+  # Attach to the staged data (once per process); nothing is copied.
+  global dataset, session
+  if dataset is not None and dataset.handles == handles:
+    # Already attached (e.g., the naive partition after the trajectory); keep the session and its caches.
+    return
+  close_session()
+  dataset = arena.SharedDataset.attach(handles)
+  session = common.EvaluationSession(cache=fprcache.FPRCache(FPR_CACHE_FOLDER, max_bytes=FPR_CACHE_MAX_BYTES))
+  for name, key in keys.items():
+    if name not in dataset:
+      session.add_table(name, TABLE_NAME, COLUMN_NAME, db_path=DB_PATH, stream=True)
+      continue
+    index_source = (DB_PATH, TABLE_NAME, COLUMN_NAME, INDEX_DIR) if name == 'table' and INDEX_DIR is not None else None
+    session.add_arena(name, dataset[name], key, index_source=index_source)
+
+def close_session():
+  # Detach from the staged data, if attached.
+  global dataset, session
+  if dataset is not None:
+    dataset.close()
+  dataset, session = None, None
+
+def init_worker(handles, keys):
+  # Attach the worker, and detach it when it exits.
+  init_session(handles, keys)
+  atexit.register(close_session)
+
+  # NOTE: Forked workers leave through `os._exit`, which skips the `atexit` hooks.
+  multiprocessing.util.Finalize(None, close_session, exitpriority=0)
+
+def compute_fpr_for_entry(index, num_partitions, timestamp, partition, solution_value, generalization=False, table_generalization=False):
+  # Evaluate in the session of this process; only the partition (and a few numbers) are sent per task.
+  return common.compute_fpr_for_entry(
+    index,
+    num_partitions,
+    TABLE_NAME,
+    COLUMN_NAME,
+    timestamp,
+    partition,
+    solution_value,
+    None,
+    dataset['train-queries'].to_list(),
+    None,
+    dataset['test-queries'].to_list(),
+    generalization=generalization,
+    table_generalization=table_generalization,
+    verbose=VERBOSE,
+    index_dir=INDEX_DIR,
+    session=session
+  )
+
+def compute_naive(config_path, handles, keys, generalization=False, table_generalization=False, summary_type='avg'):
+  # Init the analyzer.
+  analyzer = config_analyzer.ConfigAnalyzer(TABLE_NAME, COLUMN_NAME, config_path)
 
   # Get the number of bins.
   num_bins = analyzer.config['configuration']['number_of_bins']
@@ -52,31 +153,25 @@ def compute_naive(config_path, generalization=False, table_generalization=False,
   # Get the naive partition.
   partition = nutella.revert_byte_mapping(nutella.fetch_byte_mapping(None, None, num_bins=num_bins))
 
-  return common.compute_fpr_for_entry(
+  # Attach to the data.
+  init_session(handles, keys)
+
+  return compute_fpr_for_entry(
     None,
     None,
-    TABLE_NAME,
-    COLUMN_NAME,
     None,
     partition,
     None,
-    train_words,
-    train_queries,
-    all_words,
-    test_queries,
     generalization=generalization,
     table_generalization=table_generalization
   )
 
-def compute_optimized(config_path, timelimit=None, generalization=False, table_generalization=False, summary_type='avg'):
+def compute_optimized(config_path, handles, keys, timelimit=None, generalization=False, table_generalization=False, summary_type='avg'):
   print(f'Extracting data from {config_path}')
 
   # Init the analyzer.
   analyzer = config_analyzer.ConfigAnalyzer(TABLE_NAME, COLUMN_NAME, config_path)
 
-  # Get the data.
-  train_words, train_queries, all_words, test_queries = analyzer.get_data()
-
   # Get the number of partitions.
   num_partitions = len(analyzer.config.get("intermediate_solutions_time_partition", []))
 
@@ -115,42 +210,51 @@ def compute_optimized(config_path, timelimit=None, generalization=False, table_g
   for entry in chosen_entries:
     print(entry[0], entry[1])
 
+  entries = []
+  for index, entry in enumerate(chosen_entries):
+    assert len(entry) == 4
+
+    # Get the entry. NOTE: The offset has already been added.
+    threshold, _, partition, solution_value = entry
+
+    # Beyond timelimit? Then stop.
+    if timelimit is not None and threshold > timelimit:
+      break
+    entries.append((index, threshold, partition, solution_value))
+
   results = []
-  with ProcessPoolExecutor() as executor:
-    futures = []
-    for index, entry in enumerate(chosen_entries):
-      assert len(entry) == 4
-
-      # Get the entry. NOTE: The offset has already been added.
-      threshold, _, partition, solution_value = entry
-
-      # Beyond timelimit? Then stop.
-      if timelimit is not None and threshold > timelimit:
-        break
-
-      futures.append(
-        executor.submit(
-          common.compute_fpr_for_entry,
-          index,
-          num_partitions,
-          TABLE_NAME,
-          COLUMN_NAME,
-          threshold,
-          partition,
-          solution_value,
-          train_words,
-          train_queries,
-          all_words,
-          test_queries,
-          generalization=generalization,
-          table_generalization=table_generalization,
-          verbose=VERBOSE
+  if MULTI_PARTITION and all(isinstance(nutella.fetch_fingerprinter(partition), nutella.ByteFingerprinter) for _, _, partition, _ in entries):
+    # Score the whole trajectory at once.
+    init_session(handles, keys)
+    results = common.compute_fprs_for_entries(
+      entries,
+      dataset['train-queries'].to_list(),
+      dataset['test-queries'].to_list(),
+      session,
+      generalization=generalization,
+      table_generalization=table_generalization,
+      verbose=VERBOSE
+    )
+  else:
+    with ProcessPoolExecutor(initializer=init_worker, initargs=(handles, keys)) as executor:
+      futures = []
+      for index, threshold, partition, solution_value in entries:
+        futures.append(
+          executor.submit(
+            compute_fpr_for_entry,
+            index,
+            num_partitions,
+            threshold,
+            partition,
+            solution_value,
+            generalization=generalization,
+            table_generalization=table_generalization
+          )
         )
-      )
 
-    for future in as_completed(futures):
-      result = future.result()
-      results.append(result)
+      for future in as_completed(futures):
+        result = future.result()
+        results.append(result)
 
   # Sort results to maintain original time order
   results.sort(key=lambda x: x['index'])
@@ -162,22 +266,33 @@ def compute_optimized(config_path, timelimit=None, generalization=False, table_g
 
 def run(configs, timelimit=None, generalization=False, table_generalization=False):
   for config in configs:
-    # Extract the data.
-    optimized_ret = compute_optimized(
-      config['file'],
-      timelimit=timelimit,
-      generalization=generalization,
-      table_generalization=table_generalization,
-      summary_type='avg',
-    )
+    # Stage the data (shared by the optimized and the naive partitions).
+    staged, keys = stage_data(config['file'], table_generalization=table_generalization)
+
+    try:
+      # Extract the data.
+      optimized_ret = compute_optimized(
+        config['file'],
+        staged.handles,
+        keys,
+        timelimit=timelimit,
+        generalization=generalization,
+        table_generalization=table_generalization,
+        summary_type='avg',
+      )
 
-    # Compute the naive FPRs.
-    naive_ret = compute_naive(
-      config['file'],
-      generalization=generalization,
-      table_generalization=table_generalization,
-      summary_type='avg',
-    )
+      # Compute the naive FPRs.
+      naive_ret = compute_naive(
+        config['file'],
+        staged.handles,
+        keys,
+        generalization=generalization,
+        table_generalization=table_generalization,
+        summary_type='avg',
+      )
+    finally:
+      close_session()
+      staged.close()
 
     print(f'Naive')
     print(naive_ret)
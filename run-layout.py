@@ -0,0 +1,42 @@
+import os
+import utils
+import nutella
+import zonemap
+import layout
+
+TABLE_COLUMNS = [('title', 'title'), ('name', 'name'), ('name', 'name_pcode_cf'), ('cast_info', 'note')]
+BLOCK = 0
+WORKLOAD_DIR = './queries/hyper-job'
+NUMBER_OF_BINS = [8, 16, 64]
+BLOCK_SIZES = [256, 2048]
+VERBOSE = True
+
+def run(tn, cn):
+  # Read the block and the workload.
+  words = utils.read_words(f'./words/{tn}-{cn}-block-{BLOCK}.txt')
+  workload = utils.read_words(os.path.join(WORKLOAD_DIR, f'{tn}-{cn}-queries.txt'))
+
+  ret = []
+  for num_bins in NUMBER_OF_BINS:
+    # Take the naive partition.
+    partition = nutella.revert_byte_mapping(nutella.fetch_byte_mapping(None, None, num_bins=num_bins))
+
+    for block_size in BLOCK_SIZES:
+      # The original row order.
+      entry = {
+        'number_of_bins' : num_bins,
+        'block_size' : block_size,
+        'original' : zonemap.run_mechanism(words, workload, partition, block_size=block_size, verbose=VERBOSE)
+      }
+
+      # And the fingerprint-aware layouts.
+      for method in layout.LAYOUT_METHODS:
+        entry[method] = layout.run_mechanism(words, workload, partition, method=method, block_size=block_size, verbose=VERBOSE)
+      ret.append(entry)
+  return ret
+
+if __name__ == '__main__':
+  for tn, cn in TABLE_COLUMNS:
+    print(f'\n==== {tn}.{cn} ====')
+    for entry in run(tn, cn):
+      print(entry)
@@ -6,30 +6,38 @@ import duckdb
 import config_analyzer
 import pandas as pd
 import nutella
+import arena
 from concurrent.futures import ProcessPoolExecutor
 
 CONFIG_FILE = './results/title-title/results_config_title-title_1-words-title-title-block-4-title-title-queries.json'
 BLOCK_FILE = './words/title-title-block-4.txt'
 
-NUMBER_OF_BINS = [4, 8, 16]
+NUMBER_OF_BINS = [4, 8, 16, 32, 64, 128, 256]
 TIME_LIMITS = [0.1, 1, 10, 100]
 
+# Store the fingerprints in the narrowest integer column (UTINYINT for <= 8 bins, USMALLINT for <= 16).
+PACKED_STORAGE = False
+
 config = utils.read_json(CONFIG_FILE)
 
 def prepare_table_queries(competitor, config_file, tn, cn, partition, time_limit, train_queries, test_queries, table_generalization=False, common_db_path=None):
   assert common_db_path is not None
 
   # Test.
-  common.prepare_workload(competitor, config_file, common_db_path, tn, cn, 'table-val', time_limit, train_queries, partition)
+  common.prepare_workload(competitor, config_file, common_db_path, tn, cn, 'table-val', time_limit, train_queries, partition, packed=PACKED_STORAGE)
 
   # Test.
   if table_generalization:
-    common.prepare_workload(competitor, config_file, common_db_path, tn, cn, 'table-test', time_limit, test_queries, partition)
+    common.prepare_workload(competitor, config_file, common_db_path, tn, cn, 'table-test', time_limit, test_queries, partition, packed=PACKED_STORAGE)
 
 def run_nutella_worker(args):
-  entry, config_file, tn, cn, train_queries, test_queries, table_generalization, common_db_path = args
+  entry, config_file, tn, cn, query_handles, table_generalization, common_db_path = args
   threshold, _, partition, _ = entry
 
+  # Attach to the staged queries.
+  queries = arena.SharedDataset.attach(query_handles)
+  train_queries, test_queries = queries['train'].to_list(), queries['test'].to_list()
+
   prepare_table_queries(
     'optimized',
     config_file,
@@ -119,7 +127,7 @@ class RunnableConfigAnalyzer(config_analyzer.ConfigAnalyzer):
     common_db_path = '/tmp/temp.db'
     duckdb.sql(f'INSTALL json; LOAD json;')
     con = utils.open_duckdb(common_db_path, read_only=False)
-    con.execute(common.INIT_NUTELLA_SQL)
+    con.execute(common.init_nutella_sql(self.config['configuration']['number_of_bins'], packed=PACKED_STORAGE))
 
     # Register the column data.
     column_data_df = pd.DataFrame({ 'raw' : column_data })
@@ -128,7 +136,7 @@ class RunnableConfigAnalyzer(config_analyzer.ConfigAnalyzer):
     # Init the table.
     con.execute('''
       INSERT INTO tab
-      SELECT raw, 0, TRUE
+      SELECT raw, NULL, TRUE
       FROM column_data_df;
     ''')
 
@@ -187,7 +195,7 @@ class RunnableConfigAnalyzer(config_analyzer.ConfigAnalyzer):
     common_db_path = '/tmp/temp.db'
     duckdb.sql(f'INSTALL json; LOAD json;')
     con = utils.open_duckdb(common_db_path, read_only=False)
-    con.execute(common.INIT_NUTELLA_SQL)
+    con.execute(common.init_nutella_sql(self.config['configuration']['number_of_bins'], packed=PACKED_STORAGE))
 
     # Register the column data.
     column_data_df = pd.DataFrame({ 'raw' : column_data })
@@ -196,21 +204,27 @@ class RunnableConfigAnalyzer(config_analyzer.ConfigAnalyzer):
     # Init the table.
     con.execute('''
       INSERT INTO tab
-      SELECT raw, 0, TRUE
+      SELECT raw, NULL, TRUE
       FROM column_data_df;
     ''')
 
     # And close the connection.
     con.close()
 
+    # Stage the queries once; the tasks only carry their names.
+    staged_queries = arena.SharedDataset.create({ 'train' : train_queries, 'test' : test_queries })
+
     # Run in parallel.
     args_list = [
-      (entry, self.config_file, self.tn, self.cn, train_queries, test_queries, table_generalization, common_db_path)
+      (entry, self.config_file, self.tn, self.cn, staged_queries.handles, table_generalization, common_db_path)
       for entry in chosen_entries
     ]
 
-    with ProcessPoolExecutor() as executor:
-      list(executor.map(run_nutella_worker, args_list))
+    try:
+      with ProcessPoolExecutor() as executor:
+        list(executor.map(run_nutella_worker, args_list))
+    finally:
+      staged_queries.close()
 
     # Delete the temporary database file (since it's been already copied to the corresponding places).
     assert os.path.exists(common_db_path)
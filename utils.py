@@ -2,12 +2,15 @@ import os
 import re
 import json
 import duckdb
+import arena
 
 def sql_escape(s: str) -> str:
   return s.replace("'", "''")
 
-def read_words(file_path, strip_spaces=False):
+def read_words(file_path, strip_spaces=False, as_arena=False):
   assert os.path.isfile(file_path), f'File {file_path} does not exist!'
+  if as_arena:
+    return arena.StringArena.from_file(file_path, strip_spaces=strip_spaces)
   if strip_spaces:
     return [line.strip() for line in open(file_path)]
   return [line.strip('\n') for line in open(file_path)]
@@ -20,7 +23,7 @@ def load_imdb_string_cols(file_path):
     ret.add((config[0], config[1]))
   return ret
 
-def load_imdb_queries(file_path, table_name, col_name, unique=True):
+def load_imdb_queries(file_path, table_name, col_name, unique=True, anchored=False):
   all_patterns = read_json(file_path)
 
   ret = []
@@ -30,7 +33,13 @@ def load_imdb_queries(file_path, table_name, col_name, unique=True):
       like_expr = config[4]
 
       # And strip the '%'-symbol.
-      ret.append(like_expr.replace('%', ''))
+      pattern = like_expr.replace('%', '')
+
+      # Keep the anchoring of `abc%` / `%abc` (see `nutella.split_like_pattern`), if requested.
+      starts_open, ends_open = like_expr.startswith('%'), like_expr.endswith('%')
+      if anchored and starts_open != ends_open:
+        pattern = '%' + pattern if starts_open else pattern + '%'
+      ret.append(pattern)
 
   if not unique:
     return ret
@@ -0,0 +1,81 @@
+import numpy as np
+import nutella
+
+# The blocks of `data-gen.py`.
+DEFAULT_BLOCK_SIZE = 2**16
+
+def build_zonemap(fingerprints, block_size=DEFAULT_BLOCK_SIZE):
+# ORs the row fingerprints of each block into its summary.
+  fingerprints = np.asarray(fingerprints)
+  if not len(fingerprints):
+    return fingerprints[:0]
+  return np.bitwise_or.reduceat(fingerprints, np.arange(0, len(fingerprints), block_size), axis=0)
+
+def compute_block_bytes(words, block_size=DEFAULT_BLOCK_SIZE):
+# The (UTF-8) bytes of the strings in each block.
+  offsets, _ = nutella.column_buffers(words)
+  block_bounds = np.append(np.arange(0, len(offsets) - 1, block_size), len(offsets) - 1)
+  return np.diff(offsets[block_bounds])
+
+def scan(words, pattern, fingerprinter, fingerprints, zonemap, block_size=DEFAULT_BLOCK_SIZE):
+# Counts the words containing `pattern`, only reading the blocks whose summary covers the pattern mask.
+  mask = fingerprinter.build_mask_batch([pattern])
+  surviving = nutella.match_fingerprints(zonemap, mask)[0]
+
+  num_matches, num_read_rows = 0, 0
+  for block_idx in np.flatnonzero(surviving).tolist():
+    start, end = block_idx * block_size, min((block_idx + 1) * block_size, len(words))
+    num_read_rows += end - start
+
+    # Check the row fingerprints first, then the candidates.
+    candidates = np.flatnonzero(nutella.match_fingerprints(fingerprints[start:end], mask)[0])
+    num_matches += sum(nutella.matches_like_pattern(pattern, words[start + row]) for row in candidates)
+
+  return {
+    '#matches' : num_matches,
+    '#read_blocks' : int(np.count_nonzero(surviving)),
+    '#read_rows' : num_read_rows
+  }
+
+def run_workload(words, workload, partition=None, num_bins=None, block_size=DEFAULT_BLOCK_SIZE):
+# Reports, for each pattern, the blocks skipped by the zonemap and the bytes avoided.
+  # Fetch the fingerprinter.
+  fingerprinter = nutella.fetch_fingerprinter(partition, num_bins=num_bins)
+
+  # Build the zonemap.
+  zonemap = build_zonemap(fingerprinter.build_batch(words), block_size=block_size)
+  block_bytes = compute_block_bytes(words, block_size=block_size)
+
+  # And test all pattern masks against all block summaries.
+  surviving = nutella.match_fingerprints(zonemap, fingerprinter.build_mask_batch(workload))
+  num_blocks = len(zonemap)
+
+  info = []
+  for idx in range(len(workload)):
+    num_skipped = num_blocks - int(np.count_nonzero(surviving[idx]))
+    info.append({
+      '#blocks' : num_blocks,
+      '#skipped' : num_skipped,
+      'skip_rate' : num_skipped / num_blocks if num_blocks > 0 else 0.0,
+      'bytes_avoided' : int(block_bytes[~surviving[idx]].sum())
+    })
+  return info
+
+def agg_info(info):
+  num_blocks = sum(x['#blocks'] for x in info)
+  num_skipped = sum(x['#skipped'] for x in info)
+  bytes_avoided = sum(x['bytes_avoided'] for x in info)
+  skip_rate = num_skipped / num_blocks if num_blocks > 0 else 0.0
+  return num_skipped, num_blocks, skip_rate, bytes_avoided
+
+def run_mechanism(words, workload, partition, block_size=DEFAULT_BLOCK_SIZE, verbose=False):
+  # Run all patterns at once.
+  info = run_workload(words, workload, partition=partition, block_size=block_size)
+
+  # Aggregate.
+  num_skipped, num_blocks, skip_rate, bytes_avoided = agg_info(info)
+
+  if verbose:
+    print(f'# [|words|={len(words)} |workload|={len(workload)} block_size={block_size}] => #skipped={num_skipped}, #blocks={num_blocks}, skip-rate={skip_rate}, bytes-avoided={bytes_avoided}')
+
+  return skip_rate